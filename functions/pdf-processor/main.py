@@ -6,15 +6,230 @@ from datetime import datetime
 import re
 import boto3
 from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
 from google.cloud import secretmanager
 from google.cloud import storage
 from google.cloud import documentai
+from google.api_core import exceptions as google_exceptions
+from google.api_core.client_options import ClientOptions
+import grpc
 import requests
 import functions_framework
 import PyPDF2
 import io
 from urllib.parse import urlparse
 import time
+import math
+import bisect
+import hashlib
+import shutil
+import gzip
+import zlib
+import asyncio
+import threading
+import multiprocessing
+from functools import partial
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+import aiohttp
+import numpy as np
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Regex parser used to work out which characters can start a rule's match
+try:
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
+# Brotli and zstd output compression are only available when their packages are installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Our configured Document AI processor
+GCP_PROJECT_ID = "ladders-doc-pipeline-462921"
+DOCUMENTAI_PROCESSOR_ID = "fa7abbc0ea6541c5"
+DOCUMENTAI_LOCATION = "us"
+
+# Processor version to send requests to and key the OCR cache on; when unset the
+# processor's default version is looked up once per instance, and after a failed
+# lookup the OCR cache is skipped for PROCESSOR_VERSION_RETRY_SECONDS
+DOCUMENTAI_PROCESSOR_VERSION = os.environ.get('DOCUMENTAI_PROCESSOR_VERSION', '')
+PROCESSOR_VERSION_RETRY_SECONDS = int(os.environ.get('PROCESSOR_VERSION_RETRY_SECONDS', '300'))
+
+# Where cached and checkpointed OCR output is stored: "r2" (default), "local" or "none"
+OCR_STORE_BACKEND = os.environ.get('OCR_STORE_BACKEND', 'r2')
+OCR_STORE_DIR = os.environ.get('OCR_STORE_DIR', os.path.join(tempfile.gettempdir(), 'ocr-store'))
+
+# Content-addressed OCR cache shared by all documents
+OCR_CACHE_ENABLED = os.environ.get('OCR_CACHE_ENABLED', 'true').lower() == 'true'
+OCR_CACHE_PREFIX = os.environ.get('OCR_CACHE_PREFIX', 'ocr-cache')
+
+# Per-document chunk checkpoints so retried requests only OCR missing chunks
+OCR_CHECKPOINTS_ENABLED = os.environ.get('OCR_CHECKPOINTS_ENABLED', 'true').lower() == 'true'
+OCR_CHECKPOINT_PREFIX = os.environ.get('OCR_CHECKPOINT_PREFIX', 'ocr-checkpoints')
+
+# Checkpoints left behind by requests that never succeeded are deleted once they are this old,
+# checked at most once per OCR_CHECKPOINT_SWEEP_SECONDS on each instance
+OCR_CHECKPOINT_TTL_SECONDS = int(os.environ.get('OCR_CHECKPOINT_TTL_SECONDS', str(24 * 60 * 60)))
+OCR_CHECKPOINT_SWEEP_SECONDS = int(os.environ.get('OCR_CHECKPOINT_SWEEP_SECONDS', '3600'))
+
+# Document AI online processing accepts at most 15 pages per request
+MAX_CHUNK_PAGES = int(os.environ.get('MAX_CHUNK_PAGES', '15'))
+
+# Online requests are capped at 20 MB; leave headroom for structure copied into each chunk
+MAX_CHUNK_BYTES = int(os.environ.get('MAX_CHUNK_BYTES', str(18 * 1024 * 1024)))
+
+# How chunks are held between splitting and OCR: "memory" (default) or "disk"
+CHUNK_MODE = os.environ.get('CHUNK_MODE', 'memory')
+
+# How TokenTable reads Document AI responses: "protobuf" (default) or "proto-plus"
+TOKEN_TABLE_SOURCE = os.environ.get('TOKEN_TABLE_SOURCE', 'protobuf')
+
+# Very large PDFs go through batch_process_documents: "auto" (default), "always" or "never"
+BATCH_MODE = os.environ.get('BATCH_MODE', 'auto')
+BATCH_MODE_PAGE_THRESHOLD = int(os.environ.get('BATCH_MODE_PAGE_THRESHOLD', '200'))
+BATCH_MODE_BYTE_THRESHOLD = int(os.environ.get('BATCH_MODE_BYTE_THRESHOLD', str(200 * 1024 * 1024)))
+
+# Where batch input and output are staged: "gcs" (default) or "local"
+BATCH_BACKEND = os.environ.get('BATCH_BACKEND', 'gcs')
+BATCH_STAGING_BUCKET = os.environ.get('BATCH_STAGING_BUCKET', 'temp-pdfs-ladders-doc-pipeline-462921')
+BATCH_STAGING_DIR = os.environ.get('BATCH_STAGING_DIR', os.path.join(tempfile.gettempdir(), 'batch-staging'))
+BATCH_STAGING_PREFIX = os.environ.get('BATCH_STAGING_PREFIX', 'batch')
+BATCH_POLL_SECONDS = int(os.environ.get('BATCH_POLL_SECONDS', '10'))
+BATCH_TIMEOUT_SECONDS = int(os.environ.get('BATCH_TIMEOUT_SECONDS', '480'))
+
+# Documents with at least this many pages are extracted across EXTRACTION_PROCESSES processes,
+# defaulting to the CPUs this instance may run on (os.cpu_count() can report the host's)
+EXTRACTION_PROCESSES = int(os.environ.get(
+    'EXTRACTION_PROCESSES', str(len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else 1)
+))
+PARALLEL_EXTRACTION_PAGE_THRESHOLD = int(os.environ.get('PARALLEL_EXTRACTION_PAGE_THRESHOLD', '200'))
+
+# OCR chunks are queued until this many pages are waiting, then classified in one pool
+# round trip, so each trip's pickling and scheduling is spread over more pages than one chunk
+PARALLEL_EXTRACTION_BATCH_PAGES = int(os.environ.get('PARALLEL_EXTRACTION_BATCH_PAGES', '120'))
+
+# Hits of an item overlapping by this share of the smaller box are one occurrence, found
+# through a grid of DEDUP_GRID_CELLS x DEDUP_GRID_CELLS cells over each page
+DEDUP_GRID_CELLS = int(os.environ.get('DEDUP_GRID_CELLS', '100'))
+DEDUP_OVERLAP_THRESHOLD = float(os.environ.get('DEDUP_OVERLAP_THRESHOLD', '0.5'))
+
+# Compiled matcher rule sets kept per instance, least recently used dropped first
+MATCHER_CACHE_SIZE = int(os.environ.get('MATCHER_CACHE_SIZE', '32'))
+
+# Output JSON is written compact unless OUTPUT_JSON_COMPACT is "false", then compressed
+# with OUTPUT_COMPRESSION: "gzip" (default), "br", "zstd" or "none"
+OUTPUT_JSON_COMPACT = os.environ.get('OUTPUT_JSON_COMPACT', 'true').lower() == 'true'
+OUTPUT_COMPRESSION = os.environ.get('OUTPUT_COMPRESSION', 'gzip')
+
+# Items, locations and page metadata are also written as columnar tables next to the JSON:
+# "parquet" (default), "arrow" (IPC file) or "none"
+OUTPUT_COLUMNAR_FORMAT = os.environ.get('OUTPUT_COLUMNAR_FORMAT', 'parquet')
+OUTPUT_PARQUET_ROW_GROUP_SIZE = int(os.environ.get('OUTPUT_PARQUET_ROW_GROUP_SIZE', '65536'))
+
+# Per-page output shards listed in a manifest, uploaded OUTPUT_UPLOAD_WORKERS at a time,
+# and whether the single main document JSON is still written alongside them
+OUTPUT_PAGE_SHARDS = os.environ.get('OUTPUT_PAGE_SHARDS', 'true').lower() == 'true'
+OUTPUT_MONOLITHIC = os.environ.get('OUTPUT_MONOLITHIC', 'true').lower() == 'true'
+OUTPUT_UPLOAD_WORKERS = int(os.environ.get('OUTPUT_UPLOAD_WORKERS', '16'))
+
+# The main document is encoded while it uploads, as a multipart upload of
+# OUTPUT_MULTIPART_PART_BYTES parts sent OUTPUT_MULTIPART_CONCURRENCY at a time
+OUTPUT_STREAMING_UPLOAD = os.environ.get('OUTPUT_STREAMING_UPLOAD', 'true').lower() == 'true'
+OUTPUT_MULTIPART_PART_BYTES = int(os.environ.get('OUTPUT_MULTIPART_PART_BYTES', str(8 * 1024 * 1024)))
+OUTPUT_MULTIPART_CONCURRENCY = int(os.environ.get('OUTPUT_MULTIPART_CONCURRENCY', '4'))
+
+# Connections each pooled R2 client keeps open, and attempts per R2 request
+R2_MAX_POOL_CONNECTIONS = int(os.environ.get('R2_MAX_POOL_CONNECTIONS', '50'))
+R2_MAX_ATTEMPTS = int(os.environ.get('R2_MAX_ATTEMPTS', '5'))
+
+# R2 credentials are read from Secret Manager once per instance; after a failed
+# read, requests use their own r2Config for this long before trying again
+R2_CREDENTIALS_RETRY_SECONDS = int(os.environ.get('R2_CREDENTIALS_RETRY_SECONDS', '300'))
+
+# Number of chunks sent to Document AI at the same time
+CHUNK_MAX_WORKERS = int(os.environ.get('CHUNK_MAX_WORKERS', '4'))
+
+# Default execution mode ("sync" or "async"), overridable per request with executionMode
+EXECUTION_MODE = os.environ.get('EXECUTION_MODE', 'sync')
+
+# Size of blocks read from the network when downloading PDFs
+DOWNLOAD_BLOCK_SIZE = 1024 * 1024
+
+# Downloads larger than this are rejected (0 disables the limit)
+MAX_PDF_BYTES = int(os.environ.get('MAX_PDF_BYTES', str(500 * 1024 * 1024)))
+
+# Downloads are held in memory up to this size before spilling to a temporary file
+DOWNLOAD_SPOOL_BYTES = int(os.environ.get('DOWNLOAD_SPOOL_BYTES', str(32 * 1024 * 1024)))
+
+# How far into the download the %PDF- header may appear
+PDF_HEADER_SEARCH_BYTES = 1024
+
+# Event loop shared by all requests handled by this instance in async mode
+_event_loop = None
+_event_loop_lock = threading.Lock()
+_http_session = None
+
+# Document AI clients shared across requests, keyed by (project, location, processor)
+_documentai_clients = {}
+_documentai_async_clients = {}
+_documentai_clients_lock = threading.Lock()
+# (version, lookup time) per processor, version None when the lookup failed
+_processor_versions = {}
+_storage_client = None
+_checkpoint_swept_at = None
+_checkpoint_sweep_lock = threading.Lock()
+
+# R2 clients shared across requests, keyed by (endpoint, access key, secret key)
+_r2_clients = {}
+_r2_clients_lock = threading.Lock()
+_r2_credentials = None
+_r2_credentials_failed_at = None
+_r2_credentials_lock = threading.Lock()
+
+# Process pool for page-parallel extraction, started on the first large document
+_extraction_pool = None
+_extraction_pool_processes = 0
+_extraction_pool_lock = threading.Lock()
+
+# Compiled item matchers shared across requests, keyed by rule-set hash in least recently used order
+_pattern_matchers = OrderedDict()
+_pattern_matchers_lock = threading.Lock()
+
+def get_event_loop():
+    """Return the instance-wide event loop, starting it on a background thread if needed"""
+    global _event_loop
+    
+    with _event_loop_lock:
+        if _event_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="pdf-processor-loop", daemon=True).start()
+            _event_loop = loop
+    
+    return _event_loop
+
+def run_on_event_loop(coro):
+    """Run a coroutine on the shared event loop and wait for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+def get_http_session():
+    """Return the aiohttp session shared by all requests on the event loop"""
+    global _http_session
+    
+    # Only ever called from the shared event loop, so no locking is needed
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession()
+    
+    return _http_session
 
 @functions_framework.http
 def process_pdf(request):
@@ -41,16 +256,27 @@ def process_pdf(request):
         project_id = request_json.get('projectID')
         project_file_id = request_json.get('projectFileID')
         
-        # Use projectFileID as document_id if provided, otherwise generate one
+        # Use projectFileID as document_id if provided, then the caller's documentId, which
+        # stays the same across retries so they resume from checkpoints, otherwise generate one
         if project_file_id:
             document_id = project_file_id
+        elif request_json.get('documentId'):
+            document_id = request_json['documentId']
         else:
             document_id = f"doc_{int(time.time())}"
         
+        # Reject bad item rules before downloading or OCRing anything
+        matcher_rules = request_json.get('matcherRules')
+        if matcher_rules:
+            try:
+                validate_matcher_rules(matcher_rules)
+            except ValueError as e:
+                return {"status": "error", "error": f"Invalid matcherRules: {e}"}, 400
+        
         # Use our configured processor
-        processor_id = "fa7abbc0ea6541c5"
-        location = "us"
-        gcp_project_id = "ladders-doc-pipeline-462921"
+        processor_id = DOCUMENTAI_PROCESSOR_ID
+        location = DOCUMENTAI_LOCATION
+        gcp_project_id = GCP_PROJECT_ID
         
         print(f"Starting PDF processing for document ID: {document_id}")
         print(f"PDF URL: {pdf_url}")
@@ -61,8 +287,7 @@ def process_pdf(request):
         if webhook_url:
             print(f"Webhook URL: {webhook_url}")
         
-        # Process PDF
-        result = process_pdf_document(
+        document_kwargs = dict(
             pdf_url=pdf_url,
             document_id=document_id,
             processor_id=processor_id,
@@ -70,12 +295,27 @@ def process_pdf(request):
             location=location,
             r2_config=r2_config,
             app_project_id=project_id,
-            webhook_url=webhook_url
+            webhook_url=webhook_url,
+            matcher_rules=matcher_rules
         )
         
-        # Send legacy callback if provided
-        if callback_url:
-            send_callback(callback_url, result)
+        execution_mode = request_json.get('executionMode') or EXECUTION_MODE
+        
+        if execution_mode == 'async':
+            # Run on the shared event loop so concurrent requests multiplex their I/O
+            print("Using async execution mode")
+            result = run_on_event_loop(process_pdf_document_async(**document_kwargs))
+            
+            # Send legacy callback if provided
+            if callback_url:
+                run_on_event_loop(send_callback_async(callback_url, result))
+        else:
+            # Process PDF
+            result = process_pdf_document(**document_kwargs)
+            
+            # Send legacy callback if provided
+            if callback_url:
+                send_callback(callback_url, result)
         
         return {"status": "success", "document_id": document_id, "result": result}
         
@@ -83,557 +323,2926 @@ def process_pdf(request):
         print(f"Error in process_pdf: {str(e)}")
         return {"status": "error", "error": str(e)}, 500
 
-def process_pdf_document(pdf_url, document_id, processor_id, project_id, location, r2_config, app_project_id=None, webhook_url=None):
-    """Process PDF by chunking into 15-page segments for Document AI"""
+def process_pdf_document(pdf_url, document_id, processor_id, project_id, location, r2_config, app_project_id=None, webhook_url=None, matcher_rules=None):
+    """Process PDF by splitting it into planned chunks for Document AI"""
     start_time = datetime.now()
     
     print(f"Processing PDF document: {document_id}")
     
-    # Download PDF to temporary location
-    temp_pdf_path = download_pdf_to_temp(pdf_url)
+    # Stream PDF into a spooled temporary file
+    pdf_download = download_pdf(pdf_url)
+    pdf_session = None
     
     try:
-        # Extract PDF metadata first
-        pdf_metadata = extract_pdf_metadata(temp_pdf_path, pdf_url)
-        print(f"Extracted PDF metadata: {pdf_metadata['file_info']['filename']}")
-        
-        # Check PDF page count and split if necessary
-        with open(temp_pdf_path, 'rb') as pdf_file:
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            total_pages = len(pdf_reader.pages)
-            
-        print(f"PDF has {total_pages} pages")
-        
-        if total_pages <= 15:
-            # Process normally if under page limit
-            print("PDF is under 15 pages, processing normally")
-            doc = process_single_pdf_chunk(temp_pdf_path, processor_id, project_id, location)
-            all_pages = doc.pages
-            combined_text = doc.text
-        else:
-            # Split into chunks and process each
-            print(f"PDF has {total_pages} pages, splitting into chunks")
-            chunks = split_pdf_into_chunks(temp_pdf_path, max_pages=15)
-            
-            all_pages = []
-            combined_text = ""
-            page_offset = 0
-            
-            for i, chunk_path in enumerate(chunks):
-                try:
-                    print(f"Processing chunk {i+1}/{len(chunks)}")
-                    chunk_doc = process_single_pdf_chunk(chunk_path, processor_id, project_id, location)
+        # Parse the PDF once for metadata, page count and splitting
+        pdf_session = PdfSession(pdf_download.file)
+        run = DocumentRun(
+            pdf_session, pdf_download, pdf_url, document_id, processor_id, project_id, location, r2_config, matcher_rules
+        )
+        
+        chunk_timings = run.replay_cache()
+        if chunk_timings is None:
+            if run.ocr_mode == 'batch':
+                chunk_timings = run_batch_ocr(pdf_download, processor_id, project_id, location, run.analyze_chunk)
+            else:
+                chunk_timings = run_document_ocr(
+                    pdf_session, pdf_download, run.chunk_plan, processor_id, project_id, location,
+                    run.analyze_chunk, run.checkpoints, run.cache_chunk
+                )
+        
+        result = run.publish(chunk_timings, start_time, app_project_id)
+        
+        # Send webhook notification if provided
+        if webhook_url:
+            send_webhook_notification(webhook_url, result, r2_config, app_project_id)
+        
+        return result
+        
+    finally:
+        if pdf_session is not None:
+            pdf_session.close()
+        
+        # Clean up temp file
+        pdf_download.close()
+
+def inspect_pdf(pdf_session, pdf_url, pdf_sha256=None):
+    """Extract PDF metadata and page count"""
+    # Extract PDF metadata first
+    pdf_metadata = extract_pdf_metadata(pdf_session, pdf_url, pdf_sha256)
+    print(f"Extracted PDF metadata: {pdf_metadata['file_info']['filename']}")
+    
+    total_pages = pdf_session.page_count
+    print(f"PDF has {total_pages} pages")
+    
+    return pdf_metadata, total_pages
+
+def create_pdf_chunks(pdf_session, chunk_plan):
+    """Split PDF into planned chunks, or return None when it fits in one request"""
+    if len(chunk_plan["chunks"]) == 1:
+        print("PDF fits in a single request, processing normally")
+        return None
+    
+    print(f"Splitting PDF into {len(chunk_plan['chunks'])} chunks")
+    if CHUNK_MODE == 'disk':
+        return split_pdf_into_chunks(pdf_session, chunk_page_ranges(chunk_plan))
+    return iter_pdf_chunks(pdf_session, chunk_page_ranges(chunk_plan))
+
+def run_document_ocr(pdf_session, pdf_download, chunk_plan, processor_id, project_id, location, on_result, checkpoints=None, cache_chunk=None):
+    """OCR the whole PDF with Document AI, handing (document, timing) per chunk to on_result in order"""
+    chunks = create_pdf_chunks(pdf_session, chunk_plan)
+    
+    if chunks is None:
+        # Process normally if under page limit
+        chunk_start = time.monotonic()
+        doc = process_single_pdf_chunk(pdf_download.read_bytes(), processor_id, project_id, location)
+        timing = {
+            "chunk": 1,
+            "pages": len(doc.pages),
+            "latency_seconds": round(time.monotonic() - chunk_start, 3)
+        }
+        on_result(doc, timing)
+        return [timing]
+    
+    return process_chunks_concurrently(
+        chunks, processor_id, project_id, location, on_result,
+        total_chunks=len(chunk_plan["chunks"]),
+        checkpoints=checkpoints,
+        cache_chunk=cache_chunk
+    )
+
+async def run_document_ocr_async(pdf_session, pdf_download, chunk_plan, processor_id, project_id, location, on_result, checkpoints=None, cache_chunk=None):
+    """Asyncio variant of run_document_ocr"""
+    # Splitting is CPU bound, keep it off the event loop
+    chunks = await asyncio.to_thread(create_pdf_chunks, pdf_session, chunk_plan)
+    
+    if chunks is None:
+        return await process_chunks_async(
+            [pdf_download.read_bytes()], processor_id, project_id, location, on_result, total_chunks=1,
+            cache_chunk=cache_chunk
+        )
+    
+    return await process_chunks_async(
+        chunks, processor_id, project_id, location, on_result,
+        total_chunks=len(chunk_plan["chunks"]),
+        checkpoints=checkpoints,
+        cache_chunk=cache_chunk
+    )
+
+def choose_ocr_mode(total_pages, size_bytes):
+    """Pick online chunked processing or batch processing for a PDF"""
+    if BATCH_MODE in ('always', 'never'):
+        return 'batch' if BATCH_MODE == 'always' else 'online'
+    
+    if total_pages >= BATCH_MODE_PAGE_THRESHOLD or size_bytes >= BATCH_MODE_BYTE_THRESHOLD:
+        print(f"PDF has {total_pages} pages and {size_bytes} bytes, using batch processing")
+        return 'batch'
+    
+    return 'online'
+
+def get_storage_client():
+    """Return the GCS client shared across requests"""
+    global _storage_client
+    
+    with _documentai_clients_lock:
+        if _storage_client is None:
+            _storage_client = storage.Client(project=GCP_PROJECT_ID)
+    
+    return _storage_client
+
+def get_batch_staging_store():
+    """Return the staging area for batch input and output"""
+    if BATCH_BACKEND == 'local':
+        return LocalStagingStore(BATCH_STAGING_DIR)
+    return GcsStagingStore(BATCH_STAGING_BUCKET)
+
+class GcsStagingStore:
+    """Batch input and output staged in a GCS bucket and processed by Document AI"""
+    
+    def __init__(self, bucket_name):
+        self.bucket_name = bucket_name
+        self.client = get_storage_client()
+        self.bucket = self.client.bucket(bucket_name)
+    
+    def uri(self, key):
+        return f"gs://{self.bucket_name}/{key}"
+    
+    def upload_file(self, key, file_obj):
+        self.bucket.blob(key).upload_from_file(file_obj, rewind=True, content_type='application/pdf')
+        return self.uri(key)
+    
+    def list_keys(self, prefix):
+        return [blob.name for blob in self.client.list_blobs(self.bucket_name, prefix=prefix)]
+    
+    def read(self, key):
+        return self.bucket.blob(key).download_as_bytes()
+    
+    def delete_prefix(self, prefix):
+        for blob in self.client.list_blobs(self.bucket_name, prefix=prefix):
+            blob.delete()
+    
+    def start_batch_process(self, input_key, output_prefix, processor_id, project_id, location):
+        """Start a Document AI batch operation writing sharded JSON under output_prefix"""
+        request = documentai.BatchProcessRequest(
+            name=processor_name(project_id, location, processor_id),
+            input_documents=documentai.BatchDocumentsInputConfig(
+                gcs_documents=documentai.GcsDocuments(documents=[
+                    documentai.GcsDocument(gcs_uri=self.uri(input_key), mime_type="application/pdf")
+                ])
+            ),
+            document_output_config=documentai.DocumentOutputConfig(
+                gcs_output_config=documentai.DocumentOutputConfig.GcsOutputConfig(
+                    gcs_uri=self.uri(output_prefix)
+                )
+            )
+        )
+        
+        client = get_documentai_client(project_id, location, processor_id)
+        return client.batch_process_documents(request=request)
+
+class LocalStagingStore:
+    """Batch input and output staged in a local directory, standing in for GCS"""
+    
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+    
+    def _path(self, key):
+        return os.path.join(self.root_dir, *key.split('/'))
+    
+    def upload_file(self, key, file_obj):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        
+        file_obj.seek(0)
+        with open(path, 'wb') as staged_file:
+            shutil.copyfileobj(file_obj, staged_file)
+        return path
+    
+    def list_keys(self, prefix):
+        base = self._path(prefix)
+        keys = []
+        
+        for dir_path, _, file_names in os.walk(base):
+            for file_name in file_names:
+                relative = os.path.relpath(os.path.join(dir_path, file_name), self.root_dir)
+                keys.append(relative.replace(os.sep, '/'))
+        return keys
+    
+    def read(self, key):
+        with open(self._path(key), 'rb') as staged_file:
+            return staged_file.read()
+    
+    def delete_prefix(self, prefix):
+        shutil.rmtree(self._path(prefix), ignore_errors=True)
+    
+    def start_batch_process(self, input_key, output_prefix, processor_id, project_id, location):
+        """Start a stand-in batch operation that shards the PDF through online processing"""
+        return LocalBatchOperation(self, input_key, output_prefix, processor_id, project_id, location)
+
+class LocalBatchOperation:
+    """Stand-in for a batch long-running operation, writing shards like Document AI does"""
+    
+    def __init__(self, staging, input_key, output_prefix, processor_id, project_id, location):
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(staging, input_key, output_prefix, processor_id, project_id, location),
+            daemon=True
+        )
+        self._thread.start()
+    
+    def _run(self, staging, input_key, output_prefix, processor_id, project_id, location):
+        try:
+            with PdfSession(staging._path(input_key)) as pdf_session:
+                chunk_plan = plan_chunks_for_pdf(pdf_session)
+                
+                for shard_index, (start_page, end_page) in enumerate(chunk_page_ranges(chunk_plan)):
+                    chunk_doc = process_single_pdf_chunk(
+                        pdf_session.extract_pages(start_page, end_page), processor_id, project_id, location
+                    )
                     
-                    # Adjust page numbers for chunks
+                    # Batch output numbers pages within the whole document
                     for page in chunk_doc.pages:
-                        # Update page number to reflect position in original document
-                        page.page_number = page.page_number + page_offset
+                        page.page_number = page.page_number + start_page
                     
-                    all_pages.extend(chunk_doc.pages)
-                    combined_text += chunk_doc.text + "\n"
-                    page_offset += len(chunk_doc.pages)
-                    
-                finally:
-                    # Clean up chunk file
-                    if os.path.exists(chunk_path):
-                        os.unlink(chunk_path)
+                    shard_path = staging._path(f"{output_prefix}0/input-{shard_index}.json")
+                    os.makedirs(os.path.dirname(shard_path), exist_ok=True)
+                    with open(shard_path, 'w') as shard_file:
+                        shard_file.write(documentai.Document.to_json(chunk_doc))
+        except Exception as e:
+            self._error = e
+    
+    def done(self):
+        return not self._thread.is_alive()
+    
+    def result(self):
+        self._thread.join()
+        if self._error:
+            raise self._error
+
+def wait_for_batch_operation(operation, timeout=None, poll_interval=None):
+    """Poll a batch operation until it completes, raising if it failed"""
+    timeout = timeout or BATCH_TIMEOUT_SECONDS
+    poll_interval = poll_interval or BATCH_POLL_SECONDS
+    deadline = time.monotonic() + timeout
+    
+    while not operation.done():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Batch processing did not finish within {timeout}s")
+        print("Waiting for Document AI batch operation...")
+        time.sleep(poll_interval)
+    
+    # Raises the operation's error if it failed
+    operation.result()
+
+def shard_sort_key(key):
+    """Order batch output shards by their numeric shard suffix"""
+    match = re.search(r'-(\d+)\.json$', key)
+    return (int(match.group(1)) if match else 0, key)
+
+def iter_batch_output_documents(staging, output_prefix):
+    """Parse batch output shards one at a time, with page numbers made shard-local"""
+    shard_keys = sorted(
+        (key for key in staging.list_keys(output_prefix) if key.endswith('.json')),
+        key=shard_sort_key
+    )
+    print(f"Batch operation produced {len(shard_keys)} shards")
+    
+    for key in shard_keys:
+        shard_doc = documentai.Document.from_json(staging.read(key), ignore_unknown_fields=True)
+        
+        # Rebase to shard-local numbering so shards assemble like online chunks
+        if shard_doc.pages:
+            first_page_number = shard_doc.pages[0].page_number
+            for page in shard_doc.pages:
+                page.page_number = page.page_number - first_page_number + 1
+        
+        yield shard_doc
+
+def run_batch_ocr(pdf_download, processor_id, project_id, location, on_result):
+    """OCR a large PDF with batch_process_documents, handing (document, timing) per shard to on_result in order"""
+    staging = get_batch_staging_store()
+    run_prefix = f"{BATCH_STAGING_PREFIX}/{pdf_download.sha256[:16]}-{uuid.uuid4().hex}"
+    input_key = f"{run_prefix}/input.pdf"
+    output_prefix = f"{run_prefix}/output/"
+    
+    try:
+        # Stage the input for Document AI to read
+        staging.upload_file(input_key, pdf_download.file)
+        print(f"Staged batch input: {input_key}")
+        
+        operation_start = time.monotonic()
+        operation = staging.start_batch_process(input_key, output_prefix, processor_id, project_id, location)
+        wait_for_batch_operation(operation)
+        print(f"Batch operation completed in {time.monotonic() - operation_start:.2f}s")
         
-        # Create a combined document object
-        combined_doc = create_combined_document(all_pages, combined_text, total_pages)
+        # Shards are parsed and handed over one at a time
+        timings = []
+        for shard_index, shard_doc in enumerate(iter_batch_output_documents(staging, output_prefix)):
+            timing = {
+                "chunk": shard_index + 1,
+                "pages": len(shard_doc.pages),
+                "latency_seconds": round(time.monotonic() - operation_start, 3),
+                "batch": True
+            }
+            timings.append(timing)
+            on_result(shard_doc, timing)
+        
+        if not timings:
+            raise RuntimeError("Batch operation produced no output")
+        
+        return timings
+        
+    finally:
+        # Staged objects are only needed for this request
+        try:
+            staging.delete_prefix(run_prefix)
+        except Exception as e:
+            print(f"Failed to clean up batch staging: {e}")
+
+class DocumentRun:
+    """Setup and results shared by the sync and async document paths, which differ only in how they OCR"""
+    
+    def __init__(self, pdf_session, pdf_download, pdf_url, document_id, processor_id, project_id, location, r2_config, matcher_rules=None):
+        self.pdf_url = pdf_url
+        self.document_id = document_id
+        self.r2_config = r2_config
+        self.pdf_metadata, total_pages = inspect_pdf(pdf_session, pdf_url, pdf_download.sha256)
+        self.chunk_plan = plan_chunks_for_pdf(pdf_session)
+        self.ocr_mode = choose_ocr_mode(total_pages, pdf_download.size_bytes)
+        
+        # Reuse OCR output from an identical earlier upload or an interrupted attempt
+        self.ocr_cache, self.checkpoints = get_ocr_stores(r2_config, document_id, pdf_download.sha256, self.chunk_plan)
+        self.cache_key = None
+        self.chunk_results = None
+        if self.ocr_cache:
+            self.cache_key = build_ocr_cache_key(
+                pdf_download.sha256, processor_id, project_id, location, self.chunk_plan, self.ocr_mode
+            )
+            # Entries keyed on a guessed version would split the cache, so skip it instead
+            if self.cache_key is None:
+                self.ocr_cache = None
+            else:
+                self.chunk_results = self.ocr_cache.load(self.cache_key)
+        self.cache_hit = self.chunk_results is not None
         
-        print(f"Combined document has {len(all_pages)} pages")
+        # Analyze each chunk with the project's item rules as soon as its OCR output arrives
+        self.matcher = get_pattern_matcher(matcher_rules)
+        self.extraction_processes = extraction_processes(total_pages)
+        self.analyzer = DocumentAnalyzer(self.matcher, self.extraction_processes)
+        self.cached_chunks = {}
+    
+    def cache_chunk(self, index, chunk_doc, source_key=None):
+        """Store a chunk in the OCR cache, called from OCR workers so the upload overlaps other chunks"""
+        if self.ocr_cache:
+            self.cached_chunks[index + 1] = self.ocr_cache.store_chunk(self.cache_key, index + 1, chunk_doc, source_key)
+    
+    def analyze_chunk(self, chunk_doc, timing):
+        """on_result callback analyzing each chunk in document order"""
+        # Cache the raw response before it is dropped, unless a worker already did
+        if timing["chunk"] not in self.cached_chunks:
+            self.cache_chunk(timing["chunk"] - 1, chunk_doc)
+        self.analyzer.add_document(chunk_doc)
+    
+    def replay_cache(self):
+        """Analyze cached chunk results as they are read, or return None on a miss or a damaged entry"""
+        if not self.cache_hit:
+            return None
+        
+        chunk_timings = []
+        try:
+            for chunk_doc, timing in self.chunk_results:
+                self.analyzer.add_document(chunk_doc)
+                chunk_timings.append(timing)
+        except Exception as e:
+            # Start the analysis over from OCR, which also rewrites the entry
+            print(f"OCR cache replay failed, processing normally: {e}")
+            self.cache_hit = False
+            self.analyzer = DocumentAnalyzer(self.matcher, self.extraction_processes)
+            return None
+        finally:
+            self.chunk_results = None
         
-        # Extract and process data
-        processing_result = extract_and_process_data(combined_doc, document_id, pdf_url, start_time, pdf_metadata)
+        return chunk_timings
+    
+    def publish(self, chunk_timings, start_time, app_project_id=None):
+        """Build, upload and summarize the output once every chunk is analyzed"""
+        if self.ocr_cache and not self.cache_hit:
+            self.ocr_cache.store_manifest(
+                self.cache_key, [self.cached_chunks.get(timing["chunk"]) for timing in chunk_timings]
+            )
+        
+        # Build the search-optimized output from the analyzed chunks
+        processing_result = extract_and_process_data(
+            None, self.document_id, self.pdf_url, start_time, self.pdf_metadata,
+            extra_processing_metadata={
+                "ocr_mode": self.ocr_mode,
+                "chunk_plan": self.chunk_plan,
+                "ocr_chunks": chunk_timings,
+                "ocr_cache": {"key": self.cache_key, "hit": self.cache_hit},
+                "matcher_rules": self.matcher.rules_hash
+            },
+            analysis=self.analyzer.results()
+        )
         
         # Upload to R2
-        upload_result = upload_to_r2(processing_result, r2_config, document_id, app_project_id)
-        
-        processing_time = datetime.now() - start_time
-        
-        result = {
-            "document_id": document_id,
-            "status": "success",
-            "uploaded_files": upload_result,
-            "items_found": processing_result['summary']['total_items'],
-            "unique_items": processing_result['summary']['unique_items'],
-            "patterns_found": processing_result['summary']['item_breakdown']['patterns'],
-            "words_found": processing_result['summary']['item_breakdown']['words'],
-            "total_pages": processing_result['main_document']['total_pages'],
-            "processing_time": str(processing_time)
-        }
+        upload_result, artifacts = upload_to_r2(processing_result, self.r2_config, self.document_id, app_project_id)
+        
+        result = build_processing_response(self.document_id, processing_result, upload_result, start_time, artifacts)
+        
+        # Checkpoints are only needed until the request succeeds
+        if self.checkpoints:
+            self.checkpoints.clear()
+        
+        return result
+
+def build_processing_response(document_id, processing_result, upload_result, start_time, artifacts=None):
+    """Build the response returned to the caller and sent to webhooks"""
+    processing_time = datetime.now() - start_time
+    
+    return {
+        "document_id": document_id,
+        "status": "success",
+        "uploaded_files": upload_result,
+        "artifacts": artifacts or {},
+        "items_found": processing_result['summary']['total_items'],
+        "unique_items": processing_result['summary']['unique_items'],
+        "patterns_found": processing_result['summary']['item_breakdown']['patterns'],
+        "words_found": processing_result['summary']['item_breakdown']['words'],
+        "total_pages": processing_result['main_document']['total_pages'],
+        "processing_time": str(processing_time)
+    }
+
+async def process_pdf_document_async(pdf_url, document_id, processor_id, project_id, location, r2_config, app_project_id=None, webhook_url=None, matcher_rules=None):
+    """Asyncio variant of process_pdf_document that overlaps network I/O"""
+    start_time = datetime.now()
+    
+    print(f"Processing PDF document (async): {document_id}")
+    
+    # Stream PDF into a spooled temporary file
+    pdf_download = await download_pdf_async(pdf_url)
+    pdf_session = None
+    
+    try:
+        # PDF parsing, cache lookups and analysis are CPU and disk bound, keep them off the event loop
+        pdf_session = await asyncio.to_thread(PdfSession, pdf_download.file)
+        run = await asyncio.to_thread(
+            DocumentRun,
+            pdf_session, pdf_download, pdf_url, document_id, processor_id, project_id, location, r2_config, matcher_rules
+        )
+        
+        chunk_timings = await asyncio.to_thread(run.replay_cache)
+        if chunk_timings is None:
+            if run.ocr_mode == 'batch':
+                # Staging and polling are blocking calls, run them in a worker thread
+                chunk_timings = await asyncio.to_thread(
+                    run_batch_ocr, pdf_download, processor_id, project_id, location, run.analyze_chunk
+                )
+            else:
+                chunk_timings = await run_document_ocr_async(
+                    pdf_session, pdf_download, run.chunk_plan, processor_id, project_id, location,
+                    run.analyze_chunk, run.checkpoints, run.cache_chunk
+                )
+        
+        result = await asyncio.to_thread(run.publish, chunk_timings, start_time, app_project_id)
         
         # Send webhook notification if provided
         if webhook_url:
-            send_webhook_notification(webhook_url, result, r2_config, app_project_id)
+            await send_webhook_notification_async(webhook_url, result, r2_config, app_project_id)
         
         return result
         
     finally:
+        if pdf_session is not None:
+            pdf_session.close()
+        
         # Clean up temp file
-        if os.path.exists(temp_pdf_path):
-            os.unlink(temp_pdf_path)
+        pdf_download.close()
 
-def split_pdf_into_chunks(pdf_path, max_pages=15):
-    """Split PDF into chunks of max_pages or less"""
-    chunks = []
+async def process_chunks_async(chunks, processor_id, project_id, location, on_result, max_workers=None, total_chunks=None, checkpoints=None, cache_chunk=None):
+    """Process PDF chunks with the async Document AI client, handing each result to on_result in document order"""
+    max_workers = max(1, max_workers or CHUNK_MAX_WORKERS)
+    if total_chunks:
+        max_workers = min(max_workers, total_chunks)
+    semaphore = asyncio.Semaphore(max_workers)
+    chunk_label = total_chunks or "?"
     
-    with open(pdf_path, 'rb') as pdf_file:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        total_pages = len(pdf_reader.pages)
+    print(f"Dispatching {chunk_label} chunks to Document AI (async) with {max_workers} in flight")
+    
+    async def run_chunk(index, chunk):
+        chunk_start = time.monotonic()
+        try:
+            print(f"Processing chunk {index+1}/{chunk_label}")
+            chunk_doc, resumed = await ocr_chunk_with_checkpoint_async(
+                index, chunk, checkpoints, processor_id, project_id, location, cache_chunk
+            )
+        finally:
+            semaphore.release()
+            # Clean up chunk file
+            discard_chunk(chunk)
         
-        for start_page in range(0, total_pages, max_pages):
-            end_page = min(start_page + max_pages, total_pages)
+        return chunk_doc, chunk_timing(index, chunk_label, chunk_doc, chunk_start, resumed)
+    
+    chunk_iter = iter(chunks)
+    tasks = []
+    timings = []
+    
+    async def deliver(task):
+        # Result handling is CPU bound, run it off the loop while other chunks stay in flight
+        chunk_doc, timing = task.result()
+        timings.append(timing)
+        tasks[len(timings) - 1] = None
+        await asyncio.to_thread(on_result, chunk_doc, timing)
+    
+    # Finished tasks hold their result until every earlier one is delivered, so a slow chunk
+    # stops new ones from being started more than this far ahead of it
+    max_ahead = max_workers * 2
+    
+    try:
+        while True:
+            while len(tasks) - len(timings) >= max_ahead:
+                await asyncio.wait([tasks[len(timings)]])
+                await deliver(tasks[len(timings)])
             
-            # Create a new PDF with the chunk
-            pdf_writer = PyPDF2.PdfWriter()
+            # Only generate the next chunk once a slot is free, bounding chunks held in memory
+            await semaphore.acquire()
+            chunk = await asyncio.to_thread(next, chunk_iter, None)
+            if chunk is None:
+                semaphore.release()
+                break
             
-            for page_num in range(start_page, end_page):
-                pdf_writer.add_page(pdf_reader.pages[page_num])
+            tasks.append(asyncio.ensure_future(run_chunk(len(tasks), chunk)))
+            
+            # Surface failures without waiting for the rest of the document to be split
+            failed = [task for task in tasks if task and task.done() and task.exception()]
+            if failed:
+                failed[0].result()
+            
+            # Hand over finished chunks that are next in document order
+            while len(timings) < len(tasks) and tasks[len(timings)].done():
+                await deliver(tasks[len(timings)])
+        
+        while len(timings) < len(tasks):
+            await asyncio.wait([tasks[len(timings)]])
+            await deliver(tasks[len(timings)])
+        
+        return timings
+    except BaseException:
+        # Stop the remaining chunks once one has failed
+        remaining = [task for task in tasks if task]
+        for task in remaining:
+            task.cancel()
+        await asyncio.gather(*remaining, return_exceptions=True)
+        raise
+    finally:
+        close_chunk_source(chunks)
+
+def chunk_timing(index, chunk_label, chunk_doc, chunk_start, resumed):
+    """Timing entry for a chunk whose OCR started at chunk_start"""
+    latency = time.monotonic() - chunk_start
+    print(f"Chunk {index+1}/{chunk_label} completed in {latency:.2f}s")
+    return {
+        "chunk": index + 1,
+        "pages": len(chunk_doc.pages),
+        "latency_seconds": round(latency, 3),
+        "resumed": resumed
+    }
+
+def read_chunk_content(chunk):
+    """Return the PDF bytes of a chunk held in memory or in a temporary file"""
+    if isinstance(chunk, (bytes, bytearray)):
+        return bytes(chunk)
+    
+    with open(chunk, 'rb') as pdf_file:
+        return pdf_file.read()
+
+def discard_chunk(chunk):
+    """Delete a chunk's temporary file, if it has one"""
+    if isinstance(chunk, str) and os.path.exists(chunk):
+        os.unlink(chunk)
+
+def close_chunk_source(chunks):
+    """Release a chunk source after dispatch, deleting any unprocessed chunk files"""
+    if hasattr(chunks, 'close'):
+        # Stop a lazy chunk generator and close the PDF it reads from
+        chunks.close()
+    else:
+        for chunk in chunks:
+            discard_chunk(chunk)
+
+class PdfSession:
+    """A PDF parsed once and shared by metadata extraction, page counting and splitting"""
+    
+    def __init__(self, pdf_source):
+        # Accept a path, or an open file such as a spooled download which the caller closes
+        self._owns_file = not hasattr(pdf_source, 'read')
+        self._pdf_file = open(pdf_source, 'rb') if self._owns_file else pdf_source
+        try:
+            self.reader = PyPDF2.PdfReader(self._pdf_file)
+        except Exception:
+            self.close()
+            raise
+        self._page_count = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    @property
+    def page_count(self):
+        if self._page_count is None:
+            self._page_count = len(self.reader.pages)
+        return self._page_count
+    
+    @property
+    def is_encrypted(self):
+        return self.reader.is_encrypted
+    
+    @property
+    def document_info(self):
+        return self.reader.metadata
+    
+    @property
+    def file_size(self):
+        position = self._pdf_file.tell()
+        size = self._pdf_file.seek(0, io.SEEK_END)
+        self._pdf_file.seek(position)
+        return size
+    
+    def write_pages(self, start_page, end_page, output):
+        """Write pages [start_page, end_page) as a standalone PDF to a file object"""
+        pdf_writer = PyPDF2.PdfWriter()
+        
+        for page_num in range(start_page, end_page):
+            pdf_writer.add_page(self.reader.pages[page_num])
+        
+        pdf_writer.write(output)
+    
+    def estimate_page_sizes(self):
+        """Estimate each page's size in bytes without writing it out"""
+        page_sizes = []
+        
+        for page in self.reader.pages:
+            try:
+                page_sizes.append(estimate_pdf_object_bytes(page))
+            except Exception as e:
+                print(f"Could not estimate page size: {e}")
+                page_sizes.append(0)
+        
+        # Fall back to an even share of the file when streams can't be measured
+        if self.page_count and not any(page_sizes):
+            return [self.file_size // self.page_count] * self.page_count
+        
+        return page_sizes
+    
+    def extract_pages(self, start_page, end_page):
+        """Return pages [start_page, end_page) as standalone PDF bytes"""
+        buffer = io.BytesIO()
+        self.write_pages(start_page, end_page, buffer)
+        return buffer.getvalue()
+    
+    def close(self):
+        if self._owns_file:
+            self._pdf_file.close()
+
+def estimate_pdf_object_bytes(pdf_object, seen=None, depth=0):
+    """Estimate the stored size of a page or form XObject from its stream lengths"""
+    seen = set() if seen is None else seen
+    pdf_object = pdf_object.get_object()
+    if id(pdf_object) in seen or depth > 4:
+        return 0
+    seen.add(id(pdf_object))
+    
+    def stream_length(stream):
+        length = stream.get_object().get('/Length', 0)
+        return int(length.get_object()) if hasattr(length, 'get_object') else int(length)
+    
+    total = 0
+    
+    # Content streams may be a single stream or an array of them
+    contents = pdf_object.get('/Contents')
+    if contents is not None:
+        contents = contents.get_object()
+        streams = contents if isinstance(contents, list) else [contents]
+        total += sum(stream_length(stream) for stream in streams)
+    
+    # Images and form XObjects usually dominate scanned drawing sets
+    resources = pdf_object.get('/Resources')
+    xobjects = resources.get_object().get('/XObject') if resources is not None else None
+    if xobjects is not None:
+        for xobject in xobjects.get_object().values():
+            xobject = xobject.get_object()
+            if id(xobject) in seen:
+                continue
+            if xobject.get('/Subtype') == '/Form':
+                total += stream_length(xobject) + estimate_pdf_object_bytes(xobject, seen, depth + 1)
+            else:
+                seen.add(id(xobject))
+                total += stream_length(xobject)
+    
+    return total
+
+def plan_pdf_chunks(page_sizes, max_pages=None, max_bytes=None, target_concurrency=None):
+    """Plan balanced chunks that respect the processor's page and request size limits"""
+    max_pages = max_pages or MAX_CHUNK_PAGES
+    max_bytes = max_bytes or MAX_CHUNK_BYTES
+    target_concurrency = max(1, target_concurrency or CHUNK_MAX_WORKERS)
+    total_pages = len(page_sizes)
+    total_bytes = sum(page_sizes)
+    
+    # Fewest chunks that can satisfy both limits
+    chunk_count = max(1, math.ceil(total_pages / max_pages), math.ceil(total_bytes / max_bytes))
+    
+    # Once a document has to be split anyway, use every worker in the last round of requests
+    if chunk_count > 1:
+        rounds = math.ceil(chunk_count / target_concurrency)
+        chunk_count = min(total_pages, rounds * target_concurrency)
+    
+    page_target = math.ceil(total_pages / chunk_count) if total_pages else 0
+    byte_target = total_bytes / chunk_count
+    
+    page_ranges = []
+    start_page = 0
+    chunk_bytes = 0
+    
+    for page_num, page_bytes in enumerate(page_sizes):
+        chunk_pages = page_num - start_page
+        if chunk_pages and (chunk_pages >= page_target or
+                            chunk_bytes + page_bytes > max_bytes or
+                            (byte_target and chunk_bytes >= byte_target)):
+            page_ranges.append((start_page, page_num, chunk_bytes))
+            start_page = page_num
+            chunk_bytes = 0
+        chunk_bytes += page_bytes
+    
+    page_ranges.append((start_page, total_pages, chunk_bytes))
+    
+    chunks = []
+    for chunk_number, (start_page, end_page, chunk_bytes) in enumerate(page_ranges, 1):
+        if chunk_bytes > max_bytes:
+            print(f"Warning: chunk {chunk_number} (pages {start_page+1}-{end_page}) is estimated at {chunk_bytes} bytes, over the {max_bytes} byte limit")
+        chunks.append({
+            "chunk": chunk_number,
+            "start_page": start_page + 1,
+            "end_page": end_page,
+            "pages": end_page - start_page,
+            "estimated_bytes": chunk_bytes
+        })
+    
+    signature = hashlib.sha256(
+        json.dumps([[chunk["start_page"], chunk["end_page"]] for chunk in chunks]).encode('utf-8')
+    ).hexdigest()[:16]
+    
+    return {
+        "max_pages": max_pages,
+        "max_bytes": max_bytes,
+        "target_concurrency": target_concurrency,
+        "estimated_total_bytes": total_bytes,
+        "signature": signature,
+        "chunks": chunks
+    }
+
+def plan_chunks_for_pdf(pdf_session):
+    """Plan chunks for a parsed PDF from its estimated per-page sizes"""
+    chunk_plan = plan_pdf_chunks(pdf_session.estimate_page_sizes())
+    
+    print(f"Planned {len(chunk_plan['chunks'])} chunks: " +
+          ", ".join(f"{chunk['start_page']}-{chunk['end_page']}" for chunk in chunk_plan['chunks']))
+    return chunk_plan
+
+def chunk_page_ranges(chunk_plan):
+    """Return a chunk plan as zero-based [start, end) page ranges"""
+    return [(chunk["start_page"] - 1, chunk["end_page"]) for chunk in chunk_plan["chunks"]]
+
+def iter_pdf_chunks(pdf_session, page_ranges):
+    """Lazily split PDF into in-memory chunks covering each page range"""
+    for chunk_number, (start_page, end_page) in enumerate(page_ranges, 1):
+        # Serialize chunk straight to memory
+        chunk_content = pdf_session.extract_pages(start_page, end_page)
+        
+        print(f"Created chunk {chunk_number}: pages {start_page+1}-{end_page} ({len(chunk_content)} bytes)")
+        yield chunk_content
+
+def split_pdf_into_chunks(pdf_session, page_ranges):
+    """Split PDF into chunk files covering each page range"""
+    chunks = []
+    
+    for start_page, end_page in page_ranges:
+        # Save chunk to temporary file
+        chunk_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
+        pdf_session.write_pages(start_page, end_page, chunk_file)
+        chunk_file.close()
+        
+        chunks.append(chunk_file.name)
+        print(f"Created chunk {len(chunks)}: pages {start_page+1}-{end_page}")
+    
+    return chunks
+
+def process_chunks_concurrently(chunks, processor_id, project_id, location, on_result, max_workers=None, total_chunks=None, checkpoints=None, cache_chunk=None):
+    """Process PDF chunks with Document AI in parallel, handing each result to on_result in document order"""
+    max_workers = max(1, max_workers or CHUNK_MAX_WORKERS)
+    if total_chunks:
+        max_workers = min(max_workers, total_chunks)
+    chunk_label = total_chunks or "?"
+    results = {}
+    timings = []
+    
+    print(f"Dispatching {chunk_label} chunks to Document AI with {max_workers} workers")
+    
+    def run_chunk(index, chunk):
+        chunk_start = time.monotonic()
+        try:
+            print(f"Processing chunk {index+1}/{chunk_label}")
+            chunk_doc, resumed = ocr_chunk_with_checkpoint(
+                index, chunk, checkpoints, processor_id, project_id, location, cache_chunk
+            )
+        finally:
+            # Clean up chunk file
+            discard_chunk(chunk)
+        
+        return chunk_doc, chunk_timing(index, chunk_label, chunk_doc, chunk_start, resumed)
+    
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    chunk_iter = iter(chunks)
+    pending = {}
+    
+    def collect(futures):
+        for future in futures:
+            results[pending.pop(future)] = future.result()
+        
+        # Hand over every result that is next in document order while later chunks keep running
+        while len(timings) in results:
+            chunk_doc, timing = results.pop(len(timings))
+            timings.append(timing)
+            on_result(chunk_doc, timing)
+    
+    # Finished chunks wait in results until every earlier one is delivered, so a slow chunk
+    # stops new ones from being started more than this far ahead of it
+    max_ahead = max_workers * 2
+    
+    try:
+        submitted = 0
+        while True:
+            # Only generate the next chunk once a worker is free, bounding chunks held in memory
+            while pending and (len(pending) >= max_workers or submitted - len(timings) >= max_ahead):
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
             
-            # Save chunk to temporary file
-            chunk_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-            pdf_writer.write(chunk_file)
-            chunk_file.close()
+            chunk = next(chunk_iter, None)
+            if chunk is None:
+                break
             
-            chunks.append(chunk_file.name)
-            print(f"Created chunk {len(chunks)}: pages {start_page+1}-{end_page}")
+            pending[executor.submit(run_chunk, submitted, chunk)] = submitted
+            submitted += 1
+        
+        for future in as_completed(list(pending)):
+            collect([future])
+    except Exception:
+        # Don't start chunks that are still queued once one has failed
+        for future in pending:
+            future.cancel()
+        raise
+    finally:
+        executor.shutdown(wait=True)
+        close_chunk_source(chunks)
+    
+    return timings
+
+def get_documentai_client(project_id, location, processor_id):
+    """Return the shared Document AI client for a processor, creating it on first use"""
+    key = (project_id, location, processor_id)
+    client = _documentai_clients.get(key)
+    
+    if client is None:
+        with _documentai_clients_lock:
+            client = _documentai_clients.get(key)
+            if client is None:
+                print(f"Creating Document AI client for {location}/{processor_id}")
+                client = documentai.DocumentProcessorServiceClient(
+                    client_options=ClientOptions(api_endpoint=f"{location}-documentai.googleapis.com")
+                )
+                _documentai_clients[key] = client
+    
+    return client
+
+def get_documentai_async_client(project_id, location, processor_id):
+    """Return the shared async Document AI client for a processor on the event loop"""
+    key = (project_id, location, processor_id)
+    
+    # Async clients are bound to the shared event loop and only used from it
+    client = _documentai_async_clients.get(key)
+    if client is None:
+        print(f"Creating async Document AI client for {location}/{processor_id}")
+        client = documentai.DocumentProcessorServiceAsyncClient(
+            client_options=ClientOptions(api_endpoint=f"{location}-documentai.googleapis.com")
+        )
+        _documentai_async_clients[key] = client
+    
+    return client
+
+def discard_documentai_client(registry, project_id, location, processor_id, client):
+    """Drop a client with a broken channel so the next caller creates a fresh one"""
+    key = (project_id, location, processor_id)
+    
+    with _documentai_clients_lock:
+        # Another thread may already have replaced it
+        if registry.get(key) is client:
+            del registry[key]
+            print(f"Discarded Document AI client for {location}/{processor_id}")
+
+def is_broken_channel_error(error):
+    """Check whether an error means the client's gRPC channel should be recreated"""
+    if isinstance(error, google_exceptions.ServiceUnavailable):
+        return True
+    
+    # grpc raises ValueError when an RPC is attempted on a closed channel
+    return isinstance(error, ValueError) and 'closed channel' in str(error)
+
+def warm_documentai_client():
+    """Create the default Document AI client and connect its channel at cold start"""
+    try:
+        client = get_documentai_client(GCP_PROJECT_ID, DOCUMENTAI_LOCATION, DOCUMENTAI_PROCESSOR_ID)
+        channel = client.transport.grpc_channel
+    except Exception as e:
+        print(f"Document AI client warm-up failed: {e}")
+        return
+    
+    def connect():
+        try:
+            grpc.channel_ready_future(channel).result(timeout=10)
+            print("Document AI channel ready")
+        except Exception as e:
+            print(f"Document AI channel warm-up failed: {e}")
+    
+    # Connect in the background so module import is not delayed
+    threading.Thread(target=connect, name="documentai-warmup", daemon=True).start()
+
+def build_process_request(pdf_content, processor_id, project_id, location):
+    """Build a Document AI process request for PDF content"""
+    # Configure Document AI request
+    return documentai.ProcessRequest(
+        name=processor_name(project_id, location, processor_id),
+        raw_document=documentai.RawDocument(
+            content=pdf_content,
+            mime_type="application/pdf"
+        )
+    )
+
+def process_single_pdf_chunk(chunk, processor_id, project_id, location):
+    """Process a single PDF chunk with Document AI"""
+    # Read PDF content from memory or disk
+    pdf_content = read_chunk_content(chunk)
+    
+    print(f"Chunk size: {len(pdf_content)} bytes")
+    
+    # Process document
+    request = build_process_request(pdf_content, processor_id, project_id, location)
+    
+    print("Sending chunk to Document AI...")
+    client = get_documentai_client(project_id, location, processor_id)
+    try:
+        result = client.process_document(request=request)
+    except Exception as e:
+        if not is_broken_channel_error(e):
+            raise
+        
+        # Retry once on a fresh channel
+        print(f"Document AI channel error, recreating client: {e}")
+        discard_documentai_client(_documentai_clients, project_id, location, processor_id, client)
+        client = get_documentai_client(project_id, location, processor_id)
+        result = client.process_document(request=request)
+    print("Document AI chunk processing complete")
+    
+    return result.document
+
+async def process_single_pdf_chunk_async(chunk, processor_id, project_id, location):
+    """Process a single PDF chunk with the async Document AI client"""
+    # Read PDF content from memory or disk
+    pdf_content = read_chunk_content(chunk)
+    
+    print(f"Chunk size: {len(pdf_content)} bytes")
+    
+    # Process document
+    request = build_process_request(pdf_content, processor_id, project_id, location)
+    
+    print("Sending chunk to Document AI...")
+    client = get_documentai_async_client(project_id, location, processor_id)
+    try:
+        result = await client.process_document(request=request)
+    except Exception as e:
+        if not is_broken_channel_error(e):
+            raise
+        
+        # Retry once on a fresh channel
+        print(f"Document AI channel error, recreating client: {e}")
+        discard_documentai_client(_documentai_async_clients, project_id, location, processor_id, client)
+        client = get_documentai_async_client(project_id, location, processor_id)
+        result = await client.process_document(request=request)
+    print("Document AI chunk processing complete")
+    
+    return result.document
+
+def processor_name(project_id, location, processor_id):
+    """Resource name requests are sent to, pinned to DOCUMENTAI_PROCESSOR_VERSION when it is set"""
+    name = f"projects/{project_id}/locations/{location}/processors/{processor_id}"
+    if DOCUMENTAI_PROCESSOR_VERSION:
+        name = f"{name}/processorVersions/{DOCUMENTAI_PROCESSOR_VERSION}"
+    return name
+
+def get_processor_version(project_id, location, processor_id):
+    """The processor version requests are served by, looked up once per instance, or None while unknown"""
+    if DOCUMENTAI_PROCESSOR_VERSION:
+        return DOCUMENTAI_PROCESSOR_VERSION
+    
+    # Failed lookups are remembered too, so they are retried at most every PROCESSOR_VERSION_RETRY_SECONDS
+    key = (project_id, location, processor_id)
+    cached = _processor_versions.get(key)
+    if cached is not None:
+        version, looked_up_at = cached
+        if version is not None or time.monotonic() - looked_up_at < PROCESSOR_VERSION_RETRY_SECONDS:
+            return version
+    
+    try:
+        client = get_documentai_client(project_id, location, processor_id)
+        processor = client.get_processor(
+            name=f"projects/{project_id}/locations/{location}/processors/{processor_id}"
+        )
+        version = processor.default_processor_version.rsplit('/', 1)[-1] or 'default'
+    except Exception as e:
+        print(f"Could not look up processor version, skipping the OCR cache: {e}")
+        version = None
+    
+    _processor_versions[key] = (version, time.monotonic())
+    return version
+
+def build_ocr_cache_key(pdf_sha256, processor_id, project_id, location, chunk_plan, ocr_mode='online'):
+    """Build the content-addressed cache key for a PDF's OCR output, or None while the processor version is unknown"""
+    processor_version = get_processor_version(project_id, location, processor_id)
+    if processor_version is None:
+        return None
+    
+    # Batch output is sharded by Document AI, so the chunk plan doesn't apply
+    layout = 'batch' if ocr_mode == 'batch' else chunk_plan['signature']
+    key_material = f"{pdf_sha256}:{processor_id}:{processor_version}:{layout}"
+    return hashlib.sha256(key_material.encode('utf-8')).hexdigest()
+
+def get_ocr_object_store(r2_config):
+    """Return the object store for cached and checkpointed OCR output, or None when disabled"""
+    if OCR_STORE_BACKEND == 'local':
+        return LocalObjectStore(OCR_STORE_DIR)
+    
+    if OCR_STORE_BACKEND == 'r2':
+        try:
+            return R2ObjectStore(get_r2_client(r2_config), r2_config['bucketName'])
+        except Exception as e:
+            print(f"OCR object store unavailable: {e}")
+    
+    return None
+
+def get_ocr_stores(r2_config, document_id, pdf_sha256, chunk_plan):
+    """Return the OCR cache and chunk checkpoints for a document, each None when disabled"""
+    object_store = get_ocr_object_store(r2_config)
+    if object_store is None:
+        return None, None
+    
+    ocr_cache = OcrCache(object_store) if OCR_CACHE_ENABLED else None
+    checkpoints = None
+    if OCR_CHECKPOINTS_ENABLED:
+        checkpoints = ChunkCheckpoints(object_store, document_id, pdf_sha256, chunk_plan)
+        expire_stale_checkpoints(object_store)
+    return ocr_cache, checkpoints
+
+def expire_stale_checkpoints(object_store, prefix=None):
+    """Delete checkpoints older than OCR_CHECKPOINT_TTL_SECONDS, at most once per sweep interval"""
+    global _checkpoint_swept_at
+    
+    with _checkpoint_sweep_lock:
+        now = time.time()
+        if _checkpoint_swept_at is not None and now - _checkpoint_swept_at < OCR_CHECKPOINT_SWEEP_SECONDS:
+            return
+        _checkpoint_swept_at = now
+    
+    try:
+        stale_keys = list(object_store.list_older_than(f"{prefix or OCR_CHECKPOINT_PREFIX}/", now - OCR_CHECKPOINT_TTL_SECONDS))
+        for key in stale_keys:
+            object_store.delete(key)
+    except Exception as e:
+        print(f"Failed to expire stale checkpoints: {e}")
+        return
+    
+    if stale_keys:
+        print(f"Expired {len(stale_keys)} stale chunk checkpoints")
+
+class OcrCache:
+    """Serialized Document AI chunk output stored under a content-addressed key"""
+    
+    def __init__(self, object_store, prefix=None):
+        self.object_store = object_store
+        self.prefix = prefix or OCR_CACHE_PREFIX
+    
+    def _object_key(self, cache_key, name):
+        return f"{self.prefix}/{cache_key}/{name}"
+    
+    def load(self, cache_key):
+        """Return a generator of cached (document, timing) chunk results, or None on a miss"""
+        try:
+            manifest_data = self.object_store.get(self._object_key(cache_key, "manifest.json"))
+            if manifest_data is None:
+                print(f"OCR cache miss: {cache_key}")
+                return None
+            manifest = json.loads(manifest_data)
+        except Exception as e:
+            print(f"OCR cache lookup failed, processing normally: {e}")
+            return None
+        
+        print(f"OCR cache hit: {cache_key} ({len(manifest['chunks'])} chunks)")
+        return self._iter_chunks(cache_key, manifest)
+    
+    def _iter_chunks(self, cache_key, manifest):
+        # Read and parse one chunk at a time so only the chunk being analyzed is held in memory
+        for chunk_info in manifest["chunks"]:
+            chunk_data = self.object_store.get(self._object_key(cache_key, chunk_info["object"]))
+            if chunk_data is None:
+                raise RuntimeError(f"OCR cache entry {cache_key} is missing {chunk_info['object']}")
+            
+            yield documentai.Document.deserialize(chunk_data), {
+                "chunk": chunk_info["chunk"],
+                "pages": chunk_info["pages"],
+                "latency_seconds": 0,
+                "cached": True
+            }
+    
+    def store_chunk(self, cache_key, chunk_number, chunk_doc, source_key=None):
+        """Store one chunk's output, copying source_key when it already holds the serialized document,
+        and return its manifest entry or None if the upload failed"""
+        object_name = f"chunk-{chunk_number:04d}.pb"
+        object_key = self._object_key(cache_key, object_name)
+        
+        if source_key is not None:
+            try:
+                self.object_store.copy(source_key, object_key)
+                return {"chunk": chunk_number, "pages": len(chunk_doc.pages), "object": object_name}
+            except Exception as e:
+                print(f"Failed to copy OCR chunk {chunk_number} into cache, uploading it: {e}")
+        
+        try:
+            self.object_store.put(object_key, documentai.Document.serialize(chunk_doc))
+        except Exception as e:
+            print(f"Failed to store OCR chunk {chunk_number} in cache: {e}")
+            return None
+        
+        return {"chunk": chunk_number, "pages": len(chunk_doc.pages), "object": object_name}
+    
+    def store_manifest(self, cache_key, chunks):
+        """Publish a cache entry once all of its chunks are stored"""
+        if not chunks or None in chunks:
+            print(f"Not caching incomplete OCR output: {cache_key}")
+            return
+        
+        try:
+            self.object_store.put(
+                self._object_key(cache_key, "manifest.json"),
+                json.dumps({"cache_key": cache_key, "chunks": chunks}).encode('utf-8'),
+                content_type='application/json'
+            )
+            print(f"Stored OCR output in cache: {cache_key}")
+        except Exception as e:
+            print(f"Failed to store OCR output in cache: {e}")
+            # Don't fail the whole operation if caching fails
+
+class ChunkCheckpoints:
+    """Document AI output saved per chunk as it arrives, so a retried request resumes"""
+    
+    def __init__(self, object_store, document_id, pdf_sha256, chunk_plan, prefix=None):
+        self.object_store = object_store
+        # Scope checkpoints to the PDF content and chunking so a changed upload never resumes
+        self.base_key = f"{prefix or OCR_CHECKPOINT_PREFIX}/{document_id}/{pdf_sha256[:16]}-{chunk_plan['signature']}"
+        self._saved = set()
+        self._lock = threading.Lock()
+    
+    def object_key(self, index):
+        return f"{self.base_key}/chunk-{index + 1:04d}.pb"
+    
+    def load(self, index):
+        """Return the checkpointed document for a chunk, or None if it still needs OCR"""
+        try:
+            chunk_data = self.object_store.get(self.object_key(index))
+        except Exception as e:
+            print(f"Checkpoint lookup failed for chunk {index+1}: {e}")
+            return None
+        
+        if chunk_data is None:
+            return None
+        
+        with self._lock:
+            self._saved.add(index)
+        print(f"Resuming chunk {index+1} from checkpoint")
+        return documentai.Document.deserialize(chunk_data)
+    
+    def save(self, index, chunk_doc):
+        """Checkpoint a chunk's document as soon as Document AI returns it, returning whether it was saved"""
+        try:
+            self.object_store.put(self.object_key(index), documentai.Document.serialize(chunk_doc))
+        except Exception as e:
+            print(f"Failed to checkpoint chunk {index+1}: {e}")
+            # Don't fail the whole operation if checkpointing fails
+            return False
+        
+        with self._lock:
+            self._saved.add(index)
+        return True
+    
+    def clear(self):
+        """Remove this document's checkpoints once the request has succeeded"""
+        with self._lock:
+            saved = sorted(self._saved)
+            self._saved.clear()
+        
+        for index in saved:
+            try:
+                self.object_store.delete(self.object_key(index))
+            except Exception as e:
+                print(f"Failed to remove checkpoint for chunk {index+1}: {e}")
+        
+        if saved:
+            print(f"Removed {len(saved)} chunk checkpoints")
+
+def ocr_chunk_with_checkpoint(index, chunk, checkpoints, processor_id, project_id, location, cache_chunk=None):
+    """OCR a chunk unless a previous attempt already checkpointed it, then checkpoint and cache its output"""
+    chunk_doc = checkpoints.load(index) if checkpoints else None
+    resumed = chunk_doc is not None
+    
+    if not resumed:
+        chunk_doc = process_single_pdf_chunk(chunk, processor_id, project_id, location)
+    record_chunk_output(index, chunk_doc, resumed, checkpoints, cache_chunk)
+    return chunk_doc, resumed
+
+async def ocr_chunk_with_checkpoint_async(index, chunk, checkpoints, processor_id, project_id, location, cache_chunk=None):
+    """Asyncio variant of ocr_chunk_with_checkpoint"""
+    chunk_doc = await asyncio.to_thread(checkpoints.load, index) if checkpoints else None
+    resumed = chunk_doc is not None
+    
+    if not resumed:
+        chunk_doc = await process_single_pdf_chunk_async(chunk, processor_id, project_id, location)
+    await asyncio.to_thread(record_chunk_output, index, chunk_doc, resumed, checkpoints, cache_chunk)
+    return chunk_doc, resumed
+
+def record_chunk_output(index, chunk_doc, resumed, checkpoints=None, cache_chunk=None):
+    """Checkpoint a chunk's OCR output unless it was resumed from one, then cache it"""
+    checkpoint_key = None
+    if checkpoints and (resumed or checkpoints.save(index, chunk_doc)):
+        checkpoint_key = checkpoints.object_key(index)
+    
+    # The cache entry is copied from the checkpoint rather than uploaded a second time
+    if cache_chunk:
+        cache_chunk(index, chunk_doc, checkpoint_key)
+
+def extract_and_process_data(doc, document_id, pdf_url, start_time, pdf_metadata, extra_processing_metadata=None, matcher=None, analysis=None):
+    """Extract patterns and words with search-optimized structure"""
+    
+    print("Extracting patterns and words with search-optimized structure...")
+    
+    # Build items, search indexes, statistics and page metadata in a single pass,
+    # unless the chunks were already analyzed as they came back from OCR
+    if analysis is None:
+        analysis = analyze_document(doc, matcher=matcher)
+    items = analysis["items"]
+    avg_confidence = analysis["avg_confidence"]
+    pages_metadata = analysis["pages_metadata"]
+    search_indexes = analysis["search_indexes"]
+    statistics = analysis["statistics"]
+    
+    # Count totals
+    total_items = analysis["total_items"]
+    unique_items = len(items)
+    pages_with_content = analysis["pages_with_content"]
+    
+    # Create main search-optimized document
+    main_document = {
+        "document_id": document_id,
+        "source_url": pdf_url,
+        "processed_at": datetime.now().isoformat(),
+        "total_pages": analysis["page_count"],
+        "document_metadata": pdf_metadata,
+        "pages_metadata": pages_metadata,
+        "processing_metadata": {
+            "processing_time": str(datetime.now() - start_time),
+            "ocr_confidence": avg_confidence,
+            "total_items": total_items,
+            "unique_items": unique_items,
+            "pages_with_content": pages_with_content,
+            **(extra_processing_metadata or {})
+        },
+        "items": items,
+        "search_indexes": search_indexes,
+        "statistics": statistics
+    }
+    
+    # Create simplified summary for quick overview
+    summary = {
+        "document_id": document_id,
+        "total_items": total_items,
+        "unique_items": unique_items,
+        "pages_with_content": len(pages_with_content),
+        "confidence_score": avg_confidence,
+        "document_info": {
+            "filename": pdf_metadata["file_info"]["filename"],
+            "title": pdf_metadata["document_info"].get("title"),
+            "total_pages": pdf_metadata["file_info"]["total_pages"],
+            "file_size_bytes": pdf_metadata["file_info"]["file_size_bytes"]
+        },
+        "item_breakdown": {
+            "patterns": statistics["item_counts_by_type"]["pattern"],
+            "words": statistics["item_counts_by_type"]["word"]
+        },
+        "top_categories": dict(list(statistics["items_by_category"].items())[:5])
+    }
+    
+    print(f"Extracted {total_items} total items ({unique_items} unique) across {len(pages_with_content)} pages")
+    
+    return {
+        "main_document": main_document,
+        "summary": summary
+    }
+
+def unwrap_message(message):
+    """Return the raw protobuf message behind a proto-plus wrapper"""
+    pb = getattr(type(message), 'pb', None)
+    return pb(message) if pb else message
+
+# Layout element kinds stored in a TokenTable
+ELEMENT_TOKEN = 0
+ELEMENT_BLOCK = 1
+ELEMENT_PARAGRAPH = 2
+ELEMENT_LINE = 3
+
+TOKEN_TABLE_DTYPE = np.dtype([
+    ("page", np.int32),
+    ("kind", np.int8),
+    ("text_start", np.int64),
+    ("text_end", np.int64),
+    ("segment_offset", np.int64),
+    ("segment_count", np.int32),
+    ("vertex_offset", np.int64),
+    ("vertex_count", np.int32),
+    ("x0", np.float64),
+    ("y0", np.float64),
+    ("x1", np.float64),
+    ("y1", np.float64),
+    ("nx0", np.float64),
+    ("ny0", np.float64),
+    ("nx1", np.float64),
+    ("ny1", np.float64),
+    ("confidence", np.float64)
+])
+
+class TokenTable:
+    """Columnar view of a Document AI response, one row per token, block, paragraph and line"""
+    
+    def __init__(self, text, rows, segments, vertices, pages, page_offset=0):
+        self.text = text
+        self.rows = rows
+        self.segments = segments
+        self.vertices = vertices
+        self.pages = pages
+        self.page_count = len(pages)
+        self.page_offset = page_offset
+        self._codepoints = None
+    
+    @classmethod
+    def from_document(cls, doc, source=None, page_offset=0):
+        """Walk doc.pages once and copy every layout element into flat arrays, numbering pages after page_offset"""
+        # Raw protobuf access skips allocating a proto-plus wrapper on every field read
+        use_protobuf = (source or TOKEN_TABLE_SOURCE) == 'protobuf'
+        
+        columns = {name: [] for name in TOKEN_TABLE_DTYPE.names}
+        segments = []
+        vertices = []
+        normalized_bounds = []
+        pages = []
+        
+        for page_num, page in enumerate(doc.pages, page_offset + 1):
+            if use_protobuf:
+                page = unwrap_message(page)
+            
+            for kind, elements in (
+                (ELEMENT_TOKEN, page.tokens),
+                (ELEMENT_BLOCK, page.blocks),
+                (ELEMENT_PARAGRAPH, page.paragraphs),
+                (ELEMENT_LINE, page.lines)
+            ):
+                for element in elements:
+                    layout = element.layout
+                    element_segments = [
+                        (segment.start_index, segment.end_index)
+                        for segment in layout.text_anchor.text_segments
+                    ]
+                    element_vertices = [(vertex.x, vertex.y) for vertex in layout.bounding_poly.vertices]
+                    
+                    # PDF input often only carries normalized vertices
+                    if not element_vertices:
+                        normalized = [(vertex.x, vertex.y) for vertex in layout.bounding_poly.normalized_vertices]
+                        if normalized:
+                            xs, ys = zip(*normalized)
+                            normalized_bounds.append((len(columns["page"]), min(xs), min(ys), max(xs), max(ys)))
+                    
+                    columns["page"].append(page_num)
+                    columns["kind"].append(kind)
+                    columns["text_start"].append(element_segments[0][0] if element_segments else 0)
+                    columns["text_end"].append(element_segments[-1][1] if element_segments else 0)
+                    columns["segment_offset"].append(len(segments))
+                    columns["segment_count"].append(len(element_segments))
+                    columns["vertex_offset"].append(len(vertices))
+                    columns["vertex_count"].append(len(element_vertices))
+                    columns["confidence"].append(layout.confidence)
+                    segments.extend(element_segments)
+                    vertices.extend(element_vertices)
+            
+            page_vertices = [(vertex.x, vertex.y) for vertex in page.layout.bounding_poly.vertices]
+            pages.append({
+                "width": page.dimension.width,
+                "height": page.dimension.height,
+                "unit": page.dimension.unit,
+                "orientation": page.layout.orientation,
+                "bounds": page_vertices,
+                "tables": len(page.tables),
+                "form_fields": len(page.form_fields)
+            })
+        
+        rows = np.zeros(len(columns["page"]), dtype=TOKEN_TABLE_DTYPE)
+        for name in ("page", "kind", "text_start", "text_end", "segment_offset",
+                     "segment_count", "vertex_offset", "vertex_count", "confidence"):
+            rows[name] = columns[name]
+        
+        segments = np.array(segments, dtype=np.int64).reshape(-1, 2)
+        vertices = np.array(vertices, dtype=np.int64).reshape(-1, 2)
+        
+        # Axis-aligned bounds per element, NaN where an element has no vertices
+        rows["x0"] = rows["y0"] = rows["x1"] = rows["y1"] = np.nan
+        has_vertices = rows["vertex_count"] > 0
+        if has_vertices.any():
+            starts = rows["vertex_offset"][has_vertices]
+            rows["x0"][has_vertices] = np.minimum.reduceat(vertices[:, 0], starts)
+            rows["y0"][has_vertices] = np.minimum.reduceat(vertices[:, 1], starts)
+            rows["x1"][has_vertices] = np.maximum.reduceat(vertices[:, 0], starts)
+            rows["y1"][has_vertices] = np.maximum.reduceat(vertices[:, 1], starts)
+        
+        rows["nx0"] = rows["ny0"] = rows["nx1"] = rows["ny1"] = np.nan
+        if normalized_bounds:
+            normalized_bounds = np.array(normalized_bounds, dtype=np.float64)
+            normalized_rows = normalized_bounds[:, 0].astype(np.int64)
+            for column, name in enumerate(("nx0", "ny0", "nx1", "ny1"), 1):
+                rows[name][normalized_rows] = normalized_bounds[:, column]
+        
+        return cls(doc.text, rows, segments, vertices, pages, page_offset)
+    
+    @classmethod
+    def from_serialized(cls, data):
+        """Build the table straight from serialized Document bytes without proto-plus wrappers"""
+        message = documentai.Document.pb().FromString(data)
+        return cls.from_document(message, source='protobuf')
+    
+    def codepoints(self):
+        """The document text as an array of code points, indexed like the text itself"""
+        if self._codepoints is None:
+            self._codepoints = np.frombuffer(
+                self.text.encode('utf-32-le', errors='surrogatepass'), dtype='<u4'
+            )
+        return self._codepoints
+    
+    def rows_of_kind(self, *kinds):
+        """Row indexes of the given element kinds, in page order"""
+        return np.flatnonzero(np.isin(self.rows["kind"], kinds))
+    
+    def element_text(self, row_index):
+        """Text covered by an element's text anchor"""
+        row = self.rows[row_index]
+        text = self.text
+        if row["segment_count"] == 1:
+            return text[row["text_start"]:row["text_end"]]
+        
+        offset = row["segment_offset"]
+        return "".join(
+            text[start:end]
+            for start, end in self.segments[offset:offset + row["segment_count"]].tolist()
+        )
+    
+    def text_spans(self, row_index):
+        """(start, end) offsets of each of an element's text segments"""
+        row = self.rows[row_index]
+        if row["segment_count"] == 1:
+            return [(int(row["text_start"]), int(row["text_end"]))]
+        
+        offset = row["segment_offset"]
+        return self.segments[offset:offset + row["segment_count"]].tolist()
+    
+    def bounding_box(self, row_index):
+        """Bounding box of an element in the extracted item format"""
+        row = self.rows[row_index]
+        offset = row["vertex_offset"]
+        return {
+            "vertices": [
+                {"x": x, "y": y}
+                for x, y in self.vertices[offset:offset + row["vertex_count"]].tolist()
+            ]
+        }
+    
+    def counts_by_page(self, kind):
+        """Number of elements of a kind on each page, indexed from the table's first page"""
+        pages = self.rows["page"][self.rows["kind"] == kind] - (self.page_offset + 1)
+        return np.bincount(pages, minlength=self.page_count)
+    
+    def normalized_boxes(self, row_indexes):
+        """Bounds of rows as fractions of their page's size, from normalized vertices when a row has no
+        pixel vertices and NaN when it has neither"""
+        rows = self.rows
+        page_indexes = rows["page"] - (self.page_offset + 1)
+        
+        # Page dimensions, or the furthest element edge when Document AI didn't report them
+        widths = np.array([page["width"] for page in self.pages], dtype=np.float64)
+        heights = np.array([page["height"] for page in self.pages], dtype=np.float64)
+        furthest_x = np.zeros(self.page_count)
+        furthest_y = np.zeros(self.page_count)
+        has_vertices = rows["vertex_count"] > 0
+        np.maximum.at(furthest_x, page_indexes[has_vertices], rows["x1"][has_vertices])
+        np.maximum.at(furthest_y, page_indexes[has_vertices], rows["y1"][has_vertices])
+        widths = np.where(widths > 0, widths, np.where(furthest_x > 0, furthest_x, 1.0))
+        heights = np.where(heights > 0, heights, np.where(furthest_y > 0, furthest_y, 1.0))
+        
+        page_indexes = page_indexes[row_indexes]
+        boxes = np.column_stack((
+            rows["x0"][row_indexes] / widths[page_indexes],
+            rows["y0"][row_indexes] / heights[page_indexes],
+            rows["x1"][row_indexes] / widths[page_indexes],
+            rows["y1"][row_indexes] / heights[page_indexes]
+        ))
+        normalized = np.column_stack([rows[name][row_indexes] for name in ("nx0", "ny0", "nx1", "ny1")])
+        return np.where(np.isnan(boxes), normalized, boxes)
+
+class LocationGrid:
+    """Grid hash of each item's locations per page, bucketed by normalized bounding box centroid"""
+    
+    def __init__(self, cells=None, overlap=None):
+        self.cells = cells or DEDUP_GRID_CELLS
+        self.overlap = DEDUP_OVERLAP_THRESHOLD if overlap is None else overlap
+        self.buckets = {}
+    
+    def _cell(self, value):
+        return min(max(int(value * self.cells), 0), self.cells - 1)
+    
+    def add(self, item_key, page_num, box):
+        """Record a location's normalized (x0, y0, x1, y1) box"""
+        x0, y0, x1, y1 = box
+        cell = (self._cell((x0 + x1) / 2), self._cell((y0 + y1) / 2))
+        self.buckets.setdefault((item_key, page_num), {}).setdefault(cell, []).append(box)
+    
+    def count_overlapping(self, item_key, page_num, box):
+        """Number of an item's recorded locations on a page that overlap a box"""
+        page_cells = self.buckets.get((item_key, page_num))
+        if not page_cells:
+            return 0
+        
+        # Centroids inside the box or in the cells bordering it
+        x0, y0, x1, y1 = box
+        first_x, last_x = self._cell(x0) - 1, self._cell(x1) + 1
+        first_y, last_y = self._cell(y0) - 1, self._cell(y1) + 1
+        
+        # Large boxes such as blocks check the item's occupied cells rather than every cell they cover
+        if (last_x - first_x + 1) * (last_y - first_y + 1) > len(page_cells):
+            nearby = [
+                boxes for (cell_x, cell_y), boxes in page_cells.items()
+                if first_x <= cell_x <= last_x and first_y <= cell_y <= last_y
+            ]
+        else:
+            nearby = [
+                page_cells[(cell_x, cell_y)]
+                for cell_x in range(first_x, last_x + 1)
+                for cell_y in range(first_y, last_y + 1)
+                if (cell_x, cell_y) in page_cells
+            ]
+        
+        return sum(1 for boxes in nearby for other in boxes if self._overlaps(box, other))
+    
+    def _overlaps(self, box, other):
+        # Overlapping by at least the threshold share of the smaller box, which covers a token inside its block
+        width = min(box[2], other[2]) - max(box[0], other[0])
+        height = min(box[3], other[3]) - max(box[1], other[1])
+        if width < 0 or height < 0:
+            return False
+        
+        smaller = min((box[2] - box[0]) * (box[3] - box[1]), (other[2] - other[0]) * (other[3] - other[1]))
+        return smaller <= 0 or width * height >= self.overlap * smaller
+
+# Item detection rules used when a request doesn't supply matcherRules
+DEFAULT_MATCHER_RULES = {
+    # Tokens shorter than this can't match any rule and are skipped before building strings
+    "min_token_length": 2,
+    "patterns": [
+        {
+            # Matching PT-1, PT1, M1, M-1, etc.
+            "regex": r"\b(PT-?\d+|M-?\d+|[A-Z]-?\d+)\b",
+            "ignore_case": True,
+            # Checked in order against the uppercased key
+            "categories": [
+                {"category": "painting", "regex": r"PT|P[\d-]"},
+                {"category": "mechanical", "regex": r"M"},
+                {"category": "electrical", "regex": r"E"},
+                {"category": "architectural", "regex": r"A"},
+                {"category": "structural", "regex": r"S"}
+            ],
+            "default_category": "technical_code"
+        }
+    ],
+    "words": {
+        # Meaningful words (3+ chars, not purely numeric)
+        "regex": r"\b[A-Za-z][A-Za-z\s]{2,}\b",
+        "min_length": 3,
+        "categories": {
+            "architectural_element": ["door", "window", "wall", "roof", "floor", "ceiling", "beam", "column"],
+            "room_type": ["bathroom", "kitchen", "bedroom", "office", "lobby", "hallway", "closet", "storage"],
+            "material": ["concrete", "steel", "wood", "brick", "glass", "aluminum", "copper"],
+            "dimension": ["length", "width", "height", "depth", "diameter", "thickness"]
+        },
+        "default_category": "general_text"
+    },
+    # Project dictionaries, e.g. {"type": "pattern", "category": "finish", "terms": ["GWB", "ACT-1"]}
+    "literals": []
+}
+
+# Character class escapes for the regex parser's categories
+SRE_CATEGORY_CLASSES = {
+    "CATEGORY_DIGIT": r"\d", "CATEGORY_NOT_DIGIT": r"\D",
+    "CATEGORY_SPACE": r"\s", "CATEGORY_NOT_SPACE": r"\S",
+    "CATEGORY_WORD": r"\w", "CATEGORY_NOT_WORD": r"\W"
+}
+
+def first_char_regex_source(pattern):
+    """Regex matching every character a match of pattern can start with, or None if any character can"""
+    def char_class(op, av):
+        if op == "LITERAL":
+            return re.escape(chr(av))
+        if op == "NOT_LITERAL":
+            return f"[^{re.escape(chr(av))}]"
+        if op == "IN":
+            members = []
+            for member_op, member_av in av:
+                if member_op.name == "NEGATE":
+                    members.insert(0, '^')
+                elif member_op.name == "LITERAL":
+                    members.append(re.escape(chr(member_av)))
+                elif member_op.name == "RANGE":
+                    members.append(f"{re.escape(chr(member_av[0]))}-{re.escape(chr(member_av[1]))}")
+                elif member_op.name == "CATEGORY" and member_av.name in SRE_CATEGORY_CLASSES:
+                    members.append(SRE_CATEGORY_CLASSES[member_av.name])
+                else:
+                    return None
+            return f"[{''.join(members)}]"
+        return None
+    
+    def first_chars(items, ignore_case):
+        """(classes, can_match_empty) for a sequence, with classes None if unknown"""
+        classes = []
+        for op, av in items:
+            op = op.name
+            if op in ("AT", "ASSERT", "ASSERT_NOT"):
+                # Zero-width, so the next item supplies the first character
+                continue
+            if op == "SUBPATTERN":
+                group_flags = (ignore_case or av[1] & re.IGNORECASE) and not av[2] & re.IGNORECASE
+                item_classes, nullable = first_chars(av[3], group_flags)
+            elif op == "ATOMIC_GROUP":
+                item_classes, nullable = first_chars(av, ignore_case)
+            elif op == "BRANCH":
+                item_classes, nullable = [], False
+                for branch in av[1]:
+                    branch_classes, branch_nullable = first_chars(branch, ignore_case)
+                    if branch_classes is None:
+                        return None, True
+                    item_classes += branch_classes
+                    nullable = nullable or branch_nullable
+            elif op in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"):
+                item_classes, nullable = first_chars(av[2], ignore_case)
+                nullable = nullable or av[0] == 0
+            else:
+                source = char_class(op, av)
+                if source is None:
+                    return None, True
+                item_classes, nullable = [f"(?i:{source})" if ignore_case else source], False
+            
+            if item_classes is None:
+                return None, True
+            classes += item_classes
+            if not nullable:
+                return classes, False
+        return classes, True
+    
+    parsed = sre_parse.parse(pattern)
+    classes, nullable = first_chars(parsed, bool(parsed.state.flags & re.IGNORECASE))
+    if classes is None or nullable:
+        return None
+    return '|'.join(classes)
+
+def build_trie_regex(terms):
+    """Compile literal terms into a regex whose alternation follows a character trie"""
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    
+    def emit(node):
+        branches = []
+        for char in sorted(node, reverse=True):
+            if char == '':
+                continue
+            branches.append(re.escape(char) + emit(node[char]))
+        
+        if not branches:
+            return ''
+        
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # A term ending here makes the rest optional; longer terms are still tried first
+        return f'(?:{body})?' if '' in node else body
+    
+    return emit(trie)
+
+class PatternMatcher:
+    """Classifier compiled from a rule set, yielding key, type and category in one scan"""
+    
+    def __init__(self, rules):
+        self.rules = rules
+        self.rules_hash = hash_matcher_rules(rules)
+        self.min_token_length = rules.get("min_token_length", 1)
+        
+        # One named group per pattern rule, tried in order, then the word rule
+        self.pattern_rules = []
+        token_branches = []
+        for index, rule in enumerate(rules.get("patterns", [])):
+            flags = '(?i:' if rule.get("ignore_case") else '(?:'
+            token_branches.append(f"(?P<p{index}>{flags}{rule['regex']}))")
+            self.pattern_rules.append((
+                re.compile('|'.join(
+                    f"(?P<c{position}>{category['regex']})"
+                    for position, category in enumerate(rule.get("categories", []))
+                )) if rule.get("categories") else None,
+                [category["category"] for category in rule.get("categories", [])],
+                rule.get("default_category", "technical_code")
+            ))
+        
+        word_rule = rules.get("words")
+        self.word_min_length = 0
+        self.word_categories = {}
+        self.word_default_category = "general_text"
+        word_branch = []
+        if word_rule:
+            word_branch = [f"(?P<word>{word_rule['regex']})"]
+            self.word_min_length = word_rule.get("min_length", 0)
+            self.word_default_category = word_rule.get("default_category", "general_text")
+            for category, terms in word_rule.get("categories", {}).items():
+                for term in terms:
+                    self.word_categories.setdefault(term.lower(), category)
+        
+        self.token_regex = re.compile('|'.join(token_branches + word_branch)) if token_branches or word_branch else None
+        
+        # Literal dictionaries: exact token lookups, and a trie regex for finding them inside block text
+        self.literals = {}
+        for literal_rule in rules.get("literals", []):
+            item_type = literal_rule.get("type", "word")
+            for term in literal_rule.get("terms", []):
+                key = term.upper() if item_type == "pattern" else term.lower()
+                self.literals.setdefault(term.lower(), (key, item_type, literal_rule["category"]))
+        
+        # Literals win over pattern rules, as they do for whole tokens
+        block_branches = list(token_branches)
+        if self.literals:
+            block_branches.insert(0, f"(?P<literal>(?i:(?<!\\w){build_trie_regex(self.literals)}(?!\\w)))")
+        self.block_regex = re.compile('|'.join(block_branches)) if block_branches else None
+        
+        # Characters a token has to start with to match anything, derived from the rules unless
+        # token_first_char overrides it; literal lookups strip the token, so they can also start with whitespace
+        self.first_char_regex = None
+        first_char_source = rules.get("token_first_char")
+        if not first_char_source:
+            first_char_source = first_char_regex_source(self.token_regex.pattern) if self.token_regex else "(?!)"
+        if first_char_source:
+            first_char_branches = [first_char_source]
+            if self.literals:
+                first_chars = sorted({term[0] for term in self.literals})
+                first_char_branches.append(r"\s|(?i:" + '|'.join(re.escape(char) for char in first_chars) + ")")
+            self.first_char_regex = re.compile('|'.join(first_char_branches))
+    
+    def allows_first_codepoints(self, codepoints):
+        """Mask of tokens whose first character can start a match, testing each distinct character once"""
+        if self.first_char_regex is None:
+            return np.ones(len(codepoints), dtype=bool)
+        
+        distinct, inverse = np.unique(codepoints, return_inverse=True)
+        allowed = np.array([bool(self.first_char_regex.match(chr(codepoint))) for codepoint in distinct.tolist()], dtype=bool)
+        return allowed[inverse]
+    
+    def categorize_pattern(self, item_key, rule_index=0):
+        """Category of a pattern key under one of the pattern rules"""
+        category_regex, categories, default_category = self.pattern_rules[rule_index]
+        if category_regex:
+            match = category_regex.match(item_key)
+            if match:
+                return categories[int(match.lastgroup[1:])]
+        return default_category
+    
+    def categorize_word(self, item_key):
+        """Category of a word key from the word dictionaries"""
+        return self.word_categories.get(item_key.lower(), self.word_default_category)
+    
+    def classify_token(self, token_text):
+        """Return (key, type, category) for a whole token, or None if no rule matches"""
+        literal = self.literals.get(token_text.strip().lower())
+        if literal:
+            return literal
+        
+        match = self.token_regex.match(token_text) if self.token_regex else None
+        if not match:
+            return None
+        
+        if match.lastgroup == "word":
+            item_key = token_text.lower().strip()
+            if len(item_key) < self.word_min_length:
+                return None
+            return item_key, "word", self.categorize_word(item_key)
+        
+        item_key = token_text.upper().strip()
+        return item_key, "pattern", self.categorize_pattern(item_key, int(match.lastgroup[1:]))
+    
+    def scan_block(self, block_text):
+        """Yield (key, type, category) for every pattern or literal found in block text"""
+        if not self.block_regex:
+            return
+        
+        for match in self.block_regex.finditer(block_text):
+            if match.lastgroup == "literal":
+                yield self.literals[match.group().lower()]
+            else:
+                item_key = match.group().upper().strip()
+                yield item_key, "pattern", self.categorize_pattern(item_key, int(match.lastgroup[1:]))
+
+def hash_matcher_rules(rules):
+    """Stable hash of a matcher rule set"""
+    return hashlib.sha256(json.dumps(rules, sort_keys=True).encode('utf-8')).hexdigest()
+
+def validate_matcher_rules(rules):
+    """Raise ValueError describing the first problem in a request's matcher rules, compiling every regex"""
+    def require_regex(value, where, ignore_case=False):
+        if not isinstance(value, str) or not value:
+            raise ValueError(f"{where} must be a non-empty regex string")
+        try:
+            re.compile(value, re.IGNORECASE if ignore_case else 0)
+        except re.error as e:
+            raise ValueError(f"{where} is not a valid regex: {e}")
+    
+    def require_list(value, where):
+        if not isinstance(value, list):
+            raise ValueError(f"{where} must be a list")
+        return value
+    
+    def require_string(value, where):
+        if not isinstance(value, str) or not value:
+            raise ValueError(f"{where} must be a non-empty string")
+    
+    if not isinstance(rules, dict):
+        raise ValueError("rules must be an object")
+    
+    if not isinstance(rules.get("min_token_length", 1), int):
+        raise ValueError("min_token_length must be an integer")
+    if "token_first_char" in rules:
+        require_regex(rules["token_first_char"], "token_first_char")
+    
+    for index, rule in enumerate(require_list(rules.get("patterns", []), "patterns")):
+        where = f"patterns[{index}]"
+        if not isinstance(rule, dict):
+            raise ValueError(f"{where} must be an object")
+        require_regex(rule.get("regex"), f"{where}.regex", rule.get("ignore_case"))
+        for position, category in enumerate(require_list(rule.get("categories", []), f"{where}.categories")):
+            if not isinstance(category, dict):
+                raise ValueError(f"{where}.categories[{position}] must be an object")
+            require_string(category.get("category"), f"{where}.categories[{position}].category")
+            require_regex(category.get("regex"), f"{where}.categories[{position}].regex")
+    
+    word_rule = rules.get("words")
+    if word_rule:
+        if not isinstance(word_rule, dict):
+            raise ValueError("words must be an object")
+        require_regex(word_rule.get("regex"), "words.regex")
+        if not isinstance(word_rule.get("min_length", 0), int):
+            raise ValueError("words.min_length must be an integer")
+        word_categories = word_rule.get("categories", {})
+        if not isinstance(word_categories, dict):
+            raise ValueError("words.categories must map categories to lists of words")
+        for category, terms in word_categories.items():
+            for term in require_list(terms, f"words.categories.{category}"):
+                require_string(term, f"words.categories.{category} entries")
+    
+    for index, literal_rule in enumerate(require_list(rules.get("literals", []), "literals")):
+        where = f"literals[{index}]"
+        if not isinstance(literal_rule, dict):
+            raise ValueError(f"{where} must be an object")
+        if literal_rule.get("type", "word") not in ("pattern", "word"):
+            raise ValueError(f"{where}.type must be \"pattern\" or \"word\"")
+        require_string(literal_rule.get("category"), f"{where}.category")
+        for term in require_list(literal_rule.get("terms", []), f"{where}.terms"):
+            require_string(term, f"{where}.terms entries")
+    
+    # Rule regexes are also combined into one, which fails on e.g. duplicate group names
+    try:
+        get_pattern_matcher(rules)
+    except re.error as e:
+        raise ValueError(f"rules can't be combined into one regex: {e}")
+
+def get_pattern_matcher(rules=None):
+    """Return the compiled matcher for a rule set, reusing it across requests"""
+    rules = rules or DEFAULT_MATCHER_RULES
+    rules_hash = hash_matcher_rules(rules)
+    
+    with _pattern_matchers_lock:
+        matcher = _pattern_matchers.get(rules_hash)
+        if matcher is not None:
+            _pattern_matchers.move_to_end(rules_hash)
+            return matcher
+        
+        print(f"Compiling matcher rules {rules_hash[:12]}")
+        matcher = PatternMatcher(rules)
+        _pattern_matchers[rules_hash] = matcher
+        while len(_pattern_matchers) > MATCHER_CACHE_SIZE:
+            _pattern_matchers.popitem(last=False)
+    
+    return matcher
+
+class DocumentAnalyzer:
+    """Single pass over a document's TokenTables building items, search indexes, statistics and page metadata together"""
+    
+    # Documents can be added one OCR chunk at a time, in page order, so each
+    # chunk's response can be dropped as soon as it has been analyzed
+    def __init__(self, matcher=None, processes=1):
+        self.matcher = matcher or get_pattern_matcher()
+        self.processes = processes
+        self.items = {}
+        self.page_count = 0
+        self.pages_metadata = []
+        self.entity_confidences = []
+        self.paragraph_confidences = []
+        
+        # Pages each item appears on in order, the text offsets of its token hits per page and a grid
+        # hash of their boxes, so duplicate checks don't walk locations
+        self.item_pages = {}
+        self.token_offsets = {}
+        self.location_grid = LocationGrid()
+        
+        # (token_table, candidate rows) waiting to be classified in the extraction pool
+        self.pending_tables = []
+        self.pending_pages = 0
+        
+        # Index and statistics aggregates maintained as items and locations are added
+        self.by_type = {"pattern": [], "word": []}
+        self.by_category = {}
+        self.item_counts_by_type = {"pattern": 0, "word": 0}
+        self.items_by_category = {}
+        self.pattern_types = {}
+        self.locations_by_page = {}
+    
+    def _add_item(self, item_key, item_type, category):
+        self.items[item_key] = {
+            "type": item_type,
+            "category": category,
+            "total_count": 0,
+            "locations": []
+        }
+        self.item_pages[item_key] = []
+        
+        self.by_type[item_type].append(item_key)
+        self.by_category.setdefault(category, []).append(item_key)
+        self.items_by_category.setdefault(category, 0)
+        if item_type == "pattern":
+            self.pattern_types.setdefault(self._pattern_prefix(item_key), 0)
+    
+    def _add_location(self, item_key, page_num, bounding_box, confidence, box=None):
+        item = self.items[item_key]
+        item["locations"].append({
+            "page": page_num,
+            "bounding_box": bounding_box,
+            "confidence": confidence
+        })
+        item["total_count"] += 1
+        # Locations arrive in page order, so a page is new unless it was the last one seen
+        item_pages = self.item_pages[item_key]
+        if not item_pages or item_pages[-1] != page_num:
+            item_pages.append(page_num)
+        if box is not None:
+            self.location_grid.add(item_key, page_num, box)
+        
+        self.item_counts_by_type[item["type"]] += 1
+        self.items_by_category[item["category"]] += 1
+        self.locations_by_page[page_num] = self.locations_by_page.get(page_num, 0) + 1
+        if item["type"] == "pattern":
+            self.pattern_types[self._pattern_prefix(item_key)] += 1
+    
+    @staticmethod
+    def _pattern_prefix(item_key):
+        return item_key.split('-')[0] if '-' in item_key else item_key[:2]
+    
+    def add_document(self, doc, token_table=None):
+        """Analyze the next pages, from a whole document or one OCR chunk"""
+        if token_table is None:
+            token_table = TokenTable.from_document(doc, page_offset=self.page_count)
+        
+        print(f"Extracting patterns and words from pages {token_table.page_offset + 1}-{token_table.page_offset + token_table.page_count}...")
+        row_indexes = self._candidate_rows(token_table)
+        if self.processes > 1:
+            self.pending_tables.append((token_table, row_indexes))
+            self.pending_pages += token_table.page_count
+            if self.pending_pages >= PARALLEL_EXTRACTION_BATCH_PAGES:
+                self.flush()
+        else:
+            kinds = token_table.rows["kind"][row_indexes].tolist()
+            self._merge_items(
+                token_table, row_indexes, classify_elements(self.matcher, kinds, iter_element_texts(token_table, row_indexes))
+            )
+        
+        # Page metadata and confidence inputs for these pages
+        self.pages_metadata.extend(extract_page_metadata(doc, token_table))
+        for entity in getattr(doc, 'entities', []):
+            if hasattr(entity, 'confidence'):
+                self.entity_confidences.append(entity.confidence)
+        self.paragraph_confidences.append(
+            token_table.rows["confidence"][token_table.rows["kind"] == ELEMENT_PARAGRAPH]
+        )
+        
+        self.page_count += token_table.page_count
+        return self
+    
+    def flush(self):
+        """Classify and merge any pages still queued for the extraction pool"""
+        if self.pending_tables:
+            pending_tables = self.pending_tables
+            self.pending_tables = []
+            self.pending_pages = 0
+            for (token_table, row_indexes), classifications in zip(
+                pending_tables, self._classify_in_processes(pending_tables)
+            ):
+                self._merge_items(token_table, row_indexes, classifications)
+        return self
+    
+    def _candidate_rows(self, token_table):
+        """Rows of tokens and blocks that could match a rule, in page order"""
+        matcher = self.matcher
+        rows = token_table.rows
+        
+        # Tokens and blocks in page order, skipping single-segment text too short to match any rule
+        single_segment = rows["segment_count"] == 1
+        lengths = rows["text_end"] - rows["text_start"]
+        candidates = np.isin(rows["kind"], (ELEMENT_TOKEN, ELEMENT_BLOCK)) & (
+            ~single_segment | (lengths >= matcher.min_token_length)
+        )
+        
+        # Drop tokens whose first character can't start any rule, reading offsets instead of strings
+        codepoints = token_table.codepoints()
+        checkable = (
+            candidates & single_segment & (rows["kind"] == ELEMENT_TOKEN)
+            & (lengths > 0) & (rows["text_start"] < len(codepoints))
+        )
+        candidates[checkable] = matcher.allows_first_codepoints(codepoints[rows["text_start"][checkable]])
+        
+        # Only the remaining candidates are turned into Python strings
+        return np.flatnonzero(candidates)
+    
+    def _merge_items(self, token_table, row_indexes, classifications):
+        """Add classified tokens and blocks to the items with their bounding boxes"""
+        rows = token_table.rows
+        kinds = rows["kind"][row_indexes].tolist()
+        
+        # Merge in row order so items, locations and indexes come out the same however they were classified
+        for row_index, page_num, kind, text_start, confidence, box, classified in zip(
+            row_indexes.tolist(),
+            rows["page"][row_indexes].tolist(),
+            kinds,
+            rows["text_start"][row_indexes].tolist(),
+            rows["confidence"][row_indexes].tolist(),
+            token_table.normalized_boxes(row_indexes).tolist(),
+            classifications
+        ):
+            # Elements without any geometry are only matched against other hits by their text offsets
+            if math.isnan(box[0]):
+                box = None
+            
+            if kind == ELEMENT_TOKEN:
+                # Classified as a pattern, literal or meaningful word
+                if not classified:
+                    continue
+                item_key, item_type, category = classified
+                
+                # Add to items collection
+                if item_key not in self.items:
+                    self._add_item(item_key, item_type, category)
+                
+                # The same hit reported twice, as opposed to the item repeated elsewhere on the page
+                offsets = self.token_offsets.setdefault((item_key, page_num), [])
+                position = bisect.bisect_left(offsets, text_start)
+                if position < len(offsets) and offsets[position] == text_start:
+                    continue
+                if box is not None and self.location_grid.count_overlapping(item_key, page_num, box):
+                    continue
+                
+                offsets.insert(position, text_start)
+                self._add_location(item_key, page_num, token_table.bounding_box(row_index), confidence, box)
+            
+            else:
+                # Also check blocks for additional patterns (fallback), tokens come before blocks on each page
+                block_bounding_box = None
+                block_hits = {}
+                for item_key, item_type, category in classified:
+                    if item_key not in self.items:
+                        self._add_item(item_key, item_type, category)
+                    block_hits[item_key] = block_hits.get(item_key, 0) + 1
+                
+                for item_key, hits in block_hits.items():
+                    # Only occurrences the token pass missed inside this block's text are new
+                    hits -= self._token_hits_within(item_key, page_num, token_table.text_spans(row_index))
+                    
+                    for _ in range(hits):
+                        if block_bounding_box is None:
+                            block_bounding_box = token_table.bounding_box(row_index)
+                        self._add_location(item_key, page_num, block_bounding_box, confidence)
+    
+    def _token_hits_within(self, item_key, page_num, spans):
+        """Number of an item's token hits on a page whose text starts inside any of the spans"""
+        offsets = self.token_offsets.get((item_key, page_num))
+        if not offsets:
+            return 0
+        return sum(
+            bisect.bisect_left(offsets, end) - bisect.bisect_left(offsets, start)
+            for start, end in spans
+        )
+    
+    def _classify_in_processes(self, pending_tables):
+        """Classify the candidate rows of queued tables in one extraction pool round trip,
+        returning each table's classifications in row order"""
+        shards = []
+        shard_tables = []
+        
+        # Contiguous page ranges, split so there are at least as many shards as processes
+        splits = -(-self.processes // len(pending_tables))
+        for table_index, (token_table, row_indexes) in enumerate(pending_tables):
+            row_pages = token_table.rows["page"][row_indexes]
+            pages = np.unique(row_pages)
+            for page_group in np.array_split(pages, min(splits, len(pages))) if len(pages) else []:
+                shard_rows = row_indexes[np.isin(row_pages, page_group)]
+                if len(shard_rows):
+                    shards.append(build_extraction_shard(token_table, shard_rows, self.matcher.rules))
+                    shard_tables.append(table_index)
+        
+        classifications = [[] for _ in pending_tables]
+        try:
+            for table_index, shard_classifications in zip(
+                shard_tables, get_extraction_pool(self.processes).map(classify_element_shard, shards)
+            ):
+                classifications[table_index].extend(shard_classifications)
+            return classifications
+        except Exception as e:
+            print(f"Parallel extraction failed, extracting in process: {e}")
+            discard_extraction_pool()
+            return [
+                list(classify_elements(
+                    self.matcher, token_table.rows["kind"][row_indexes].tolist(), iter_element_texts(token_table, row_indexes)
+                ))
+                for token_table, row_indexes in pending_tables
+            ]
+    
+    def search_indexes(self):
+        """Item keys indexed by page, type and category"""
+        by_page = {}
+        
+        # Item pages are already distinct, so no membership checks are needed
+        for item_key, pages in self.item_pages.items():
+            for page in pages:
+                by_page.setdefault(str(page), []).append(item_key)
+        
+        return {
+            "by_page": by_page,
+            "by_type": self.by_type,
+            "by_category": self.by_category
+        }
+    
+    def statistics(self, by_page):
+        """Counts by type, category and pattern prefix, top words and pages by item density"""
+        word_frequency = {
+            item_key: self.items[item_key]["total_count"] for item_key in self.by_type["word"]
+        }
+        # Pages in by_page order, which ties in the density sort fall back on
+        page_density = {int(page): self.locations_by_page[int(page)] for page in by_page}
+        
+        # Sort and limit results
+        items_by_category = dict(sorted(self.items_by_category.items(), key=lambda x: x[1], reverse=True))
+        pattern_types = dict(sorted(self.pattern_types.items(), key=lambda x: x[1], reverse=True))
+        word_frequency = dict(sorted(word_frequency.items(), key=lambda x: x[1], reverse=True)[:20])  # Top 20 words
+        pages_by_density = [{"page": page, "item_count": count} for page, count in sorted(page_density.items(), key=lambda x: x[1], reverse=True)]
+        
+        return {
+            "item_counts_by_type": dict(self.item_counts_by_type),
+            "items_by_category": items_by_category,
+            "pattern_types": pattern_types,
+            "word_frequency": word_frequency,
+            "pages_by_density": pages_by_density
+        }
+    
+    def average_confidence(self):
+        """Average entity confidence, or paragraph confidence when there are no entities, over every page added so far"""
+        if self.entity_confidences:
+            return sum(self.entity_confidences) / len(self.entity_confidences)
+        
+        paragraph_confidences = np.concatenate(self.paragraph_confidences) if self.paragraph_confidences else []
+        return float(paragraph_confidences.mean()) if len(paragraph_confidences) else 0.95
+    
+    def results(self):
+        """Everything extract_and_process_data needs from the document"""
+        self.flush()
+        print(f"Found {len(self.items)} unique items")
+        print(f"Patterns: {len(self.by_type['pattern'])}, Words: {len(self.by_type['word'])}")
+        
+        search_indexes = self.search_indexes()
+        statistics = self.statistics(search_indexes["by_page"])
+        
+        return {
+            "items": self.items,
+            "search_indexes": search_indexes,
+            "statistics": statistics,
+            "avg_confidence": self.average_confidence(),
+            "pages_metadata": self.pages_metadata,
+            "page_count": self.page_count,
+            "total_items": sum(self.item_counts_by_type.values()),
+            "pages_with_content": sorted(int(page) for page in search_indexes["by_page"])
+        }
+
+def analyze_document(doc, token_table=None, matcher=None, processes=None):
+    """Extract items, indexes, statistics, confidence and page metadata in one pass"""
+    processes = processes or extraction_processes(len(doc.pages))
+    return DocumentAnalyzer(matcher, processes).add_document(doc, token_table).results()
+
+def extract_items_with_bounding_boxes(doc, token_table=None, matcher=None, processes=None):
+    """Extract both patterns and words with bounding boxes from Document AI tokens"""
+    processes = processes or extraction_processes(len(doc.pages))
+    return DocumentAnalyzer(matcher, processes).add_document(doc, token_table).flush().items
+
+def iter_element_texts(token_table, row_indexes):
+    """Text of each row, slicing the document text directly for single-segment anchors"""
+    rows = token_table.rows
+    text = token_table.text
+    
+    for row_index, text_start, text_end, segment_count in zip(
+        row_indexes.tolist(),
+        rows["text_start"][row_indexes].tolist(),
+        rows["text_end"][row_indexes].tolist(),
+        rows["segment_count"][row_indexes].tolist()
+    ):
+        if segment_count == 1:
+            yield text[text_start:text_end]
+        else:
+            yield token_table.element_text(row_index)
+
+def classify_elements(matcher, kinds, element_texts):
+    """Classify tokens and scan blocks, yielding a (key, type, category) or None per token and a list per block"""
+    for kind, element_text in zip(kinds, element_texts):
+        if kind == ELEMENT_TOKEN:
+            yield matcher.classify_token(element_text) if element_text.strip() else None
+        else:
+            yield list(matcher.scan_block(element_text))
+
+def extraction_processes(page_count):
+    """Processes to extract with, using the pool only for documents above the page threshold"""
+    if EXTRACTION_PROCESSES > 1 and page_count >= PARALLEL_EXTRACTION_PAGE_THRESHOLD:
+        return EXTRACTION_PROCESSES
+    return 1
+
+def get_extraction_pool(processes):
+    """Return the process pool used for page-parallel extraction, shared across requests"""
+    global _extraction_pool, _extraction_pool_processes
+    
+    with _extraction_pool_lock:
+        if _extraction_pool is not None and _extraction_pool_processes != processes:
+            _extraction_pool.shutdown(wait=False)
+            _extraction_pool = None
+        
+        if _extraction_pool is None:
+            print(f"Starting extraction pool with {processes} processes")
+            # Spawned workers don't inherit gRPC channels or the event loop thread
+            _extraction_pool = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _extraction_pool_processes = processes
+    
+    return _extraction_pool
+
+def discard_extraction_pool():
+    """Drop a broken extraction pool so the next request starts a fresh one"""
+    global _extraction_pool
+    
+    with _extraction_pool_lock:
+        if _extraction_pool is not None:
+            _extraction_pool.shutdown(wait=False, cancel_futures=True)
+            _extraction_pool = None
+
+def build_extraction_shard(token_table, row_indexes, rules):
+    """Plain arrays and text for one shard of rows, so workers never unpickle Document AI objects"""
+    rows = token_table.rows
+    starts = rows["text_start"][row_indexes]
+    ends = rows["text_end"][row_indexes]
+    single_segment = rows["segment_count"][row_indexes] == 1
+    
+    # Ship only the span of text the shard covers, with offsets rebased onto it
+    span_start = int(starts[single_segment].min()) if single_segment.any() else 0
+    span_end = int(ends[single_segment].max()) if single_segment.any() else 0
+    
+    return {
+        "rules": rules,
+        "text": token_table.text[span_start:span_end],
+        "kinds": rows["kind"][row_indexes],
+        "starts": starts - span_start,
+        "ends": ends - span_start,
+        "multi_segment_texts": {
+            position: token_table.element_text(row_index)
+            for position, row_index in enumerate(row_indexes.tolist())
+            if not single_segment[position]
+        }
+    }
+
+def classify_element_shard(shard):
+    """Extraction pool entry point, classifying one shard of tokens and blocks"""
+    matcher = get_pattern_matcher(shard["rules"])
+    text = shard["text"]
+    multi_segment_texts = shard["multi_segment_texts"]
+    
+    element_texts = (
+        multi_segment_texts[position] if position in multi_segment_texts else text[start:end]
+        for position, (start, end) in enumerate(zip(shard["starts"].tolist(), shard["ends"].tolist()))
+    )
+    return list(classify_elements(matcher, shard["kinds"].tolist(), element_texts))
+
+def categorize_pattern(pattern_text):
+    """Categorize technical patterns"""
+    return get_pattern_matcher().categorize_pattern(pattern_text)
+
+def categorize_word(word_text):
+    """Categorize words by type"""
+    return get_pattern_matcher().categorize_word(word_text)
+
+def get_r2_credentials(r2_config):
+    """Get R2 credentials from Secret Manager once per instance, falling back to the request config"""
+    global _r2_credentials, _r2_credentials_failed_at
+    
+    # Concurrent requests wait for one lookup instead of each making their own
+    with _r2_credentials_lock:
+        retry_due = (
+            _r2_credentials_failed_at is None
+            or time.monotonic() - _r2_credentials_failed_at >= R2_CREDENTIALS_RETRY_SECONDS
+        )
+        if _r2_credentials is None and retry_due:
+            try:
+                _r2_credentials = read_r2_secrets()
+                _r2_credentials_failed_at = None
+            except Exception as e:
+                print(f"Error retrieving R2 credentials: {e}")
+                _r2_credentials_failed_at = time.monotonic()
+        
+        if _r2_credentials is not None:
+            return _r2_credentials
+    
+    # Fallback to provided config
+    return r2_config.get('accessKey'), r2_config.get('secretKey'), r2_config.get('endpoint')
+
+def read_r2_secrets():
+    """Read the R2 access key, secret key and endpoint from Secret Manager"""
+    client = secretmanager.SecretManagerServiceClient()
+    project_id = GCP_PROJECT_ID
+    
+    access_key = client.access_secret_version(
+        request={"name": f"projects/{project_id}/secrets/r2-access-key/versions/latest"}
+    ).payload.data.decode("UTF-8")
+    
+    secret_key = client.access_secret_version(
+        request={"name": f"projects/{project_id}/secrets/r2-secret-key/versions/latest"}
+    ).payload.data.decode("UTF-8")
+    
+    endpoint = client.access_secret_version(
+        request={"name": f"projects/{project_id}/secrets/r2-endpoint/versions/latest"}
+    ).payload.data.decode("UTF-8")
+    
+    return access_key, secret_key, endpoint
+
+def create_r2_client(access_key, secret_key, endpoint):
+    """Create an S3 client for R2"""
+    # Enough pooled connections for parallel artifact uploads and multipart parts
+    return boto3.client(
+        's3',
+        endpoint_url=endpoint,
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        config=Config(
+            signature_version='s3v4',
+            max_pool_connections=R2_MAX_POOL_CONNECTIONS,
+            retries={'mode': 'standard', 'max_attempts': R2_MAX_ATTEMPTS}
+        ),
+        region_name='auto'
+    )
+
+def get_r2_client(r2_config):
+    """Return the R2 client shared across requests for the configured endpoint and credentials"""
+    access_key, secret_key, endpoint = get_r2_credentials(r2_config)
+    client_key = (endpoint, access_key, secret_key)
+    
+    # Client creation goes through boto3's default session, which isn't thread-safe
+    with _r2_clients_lock:
+        r2_client = _r2_clients.get(client_key)
+        if r2_client is None:
+            print(f"Creating R2 client for {endpoint}")
+            r2_client = create_r2_client(access_key, secret_key, endpoint)
+            _r2_retries.watch(r2_client)
+            _r2_clients[client_key] = r2_client
+    
+    return r2_client
+
+class RetryCounter:
+    """Retries of S3 requests per tracked object key, counted across the threads of watched clients"""
+    
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+    
+    def watch(self, s3_client):
+        s3_client.meta.events.register('before-parameter-build.s3', self._remember_key)
+        s3_client.meta.events.register('after-call.s3', self._count_retries)
+    
+    def _remember_key(self, params, context, **kwargs):
+        context['object_key'] = params.get('Key')
+    
+    def _count_retries(self, parsed, context, **kwargs):
+        retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+        object_key = context.get('object_key')
+        if retries and object_key:
+            # Other keys, like OCR cache and checkpoint objects, are never popped so aren't counted
+            with self._lock:
+                if object_key in self._counts:
+                    self._counts[object_key] += retries
+    
+    def track(self, key):
+        """Start counting retries for a key"""
+        with self._lock:
+            self._counts[key] = 0
+    
+    def pop(self, key):
+        """Stop counting retries for a key, returning the retries counted since it was tracked"""
+        with self._lock:
+            return self._counts.pop(key, 0)
+
+# Retry counts for uploads through any pooled R2 client
+_r2_retries = RetryCounter()
+
+class R2ObjectStore:
+    """Binary objects stored in an R2 bucket"""
+    
+    def __init__(self, r2_client, bucket_name):
+        self.r2_client = r2_client
+        self.bucket_name = bucket_name
+    
+    def get(self, key):
+        try:
+            response = self.r2_client.get_object(Bucket=self.bucket_name, Key=key)
+        except self.r2_client.exceptions.NoSuchKey:
+            return None
+        return response['Body'].read()
+    
+    def put(self, key, data, content_type='application/octet-stream'):
+        self.r2_client.put_object(Bucket=self.bucket_name, Key=key, Body=data, ContentType=content_type)
+    
+    def list_older_than(self, prefix, cutoff):
+        """Keys under prefix last modified before the cutoff epoch time"""
+        paginator = self.r2_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for entry in page.get('Contents', []):
+                if entry['LastModified'].timestamp() < cutoff:
+                    yield entry['Key']
     
-    return chunks
+    def copy(self, source_key, key):
+        # Server-side, the object's bytes never pass through this instance
+        self.r2_client.copy_object(
+            Bucket=self.bucket_name, Key=key, CopySource={'Bucket': self.bucket_name, 'Key': source_key}
+        )
+    
+    def delete(self, key):
+        self.r2_client.delete_object(Bucket=self.bucket_name, Key=key)
 
-def process_single_pdf_chunk(pdf_path, processor_id, project_id, location):
-    """Process a single PDF chunk with Document AI"""
-    client = documentai.DocumentProcessorServiceClient()
+class LocalObjectStore:
+    """Binary objects stored in a local directory, standing in for R2"""
     
-    # Read PDF file
-    with open(pdf_path, 'rb') as pdf_file:
-        pdf_content = pdf_file.read()
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
     
-    print(f"Chunk file size: {len(pdf_content)} bytes")
+    def _path(self, key):
+        return os.path.join(self.root_dir, *key.split('/'))
     
-    # Configure Document AI request
-    processor_name = f"projects/{project_id}/locations/{location}/processors/{processor_id}"
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as object_file:
+                return object_file.read()
+        except FileNotFoundError:
+            return None
     
-    # Process document
-    request = documentai.ProcessRequest(
-        name=processor_name,
-        raw_document=documentai.RawDocument(
-            content=pdf_content,
-            mime_type="application/pdf"
-        )
-    )
+    def put(self, key, data, content_type='application/octet-stream'):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        
+        # Write then rename so readers never see a partial object
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'wb') as object_file:
+            object_file.write(data)
+        os.replace(temp_path, path)
     
-    print("Sending chunk to Document AI...")
-    result = client.process_document(request=request)
-    print("Document AI chunk processing complete")
+    def list_older_than(self, prefix, cutoff):
+        """Keys under prefix last modified before the cutoff epoch time"""
+        for dir_path, _, file_names in os.walk(self._path(prefix)):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                if os.path.getmtime(path) < cutoff:
+                    yield os.path.relpath(path, self.root_dir).replace(os.sep, '/')
     
-    return result.document
+    def copy(self, source_key, key):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        shutil.copyfile(self._path(source_key), temp_path)
+        os.replace(temp_path, path)
+    
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+def encode_json(data, compact=None):
+    """Encode data as UTF-8 JSON bytes, compact or indented"""
+    compact = OUTPUT_JSON_COMPACT if compact is None else compact
+    option = orjson.OPT_NON_STR_KEYS
+    if not compact:
+        option |= orjson.OPT_INDENT_2
+    return orjson.dumps(data, option=option)
 
-def create_combined_document(all_pages, combined_text, total_pages):
-    """Create a combined document object from processed chunks"""
-    # Create a mock document object with the combined data
-    class CombinedDocument:
-        def __init__(self, pages, text):
-            self.pages = pages
-            self.text = text
-            self.entities = []  # Empty for now
+def resolve_compression(compression=None):
+    """Output compression to use, falling back to gzip when the configured package is missing"""
+    compression = compression or OUTPUT_COMPRESSION
     
-    return CombinedDocument(all_pages, combined_text)
+    if compression == 'br' and brotli is None or compression == 'zstd' and zstandard is None:
+        print(f"{compression} compression is not installed, using gzip")
+        compression = 'gzip'
+    return compression
 
-def extract_and_process_data(doc, document_id, pdf_url, start_time, pdf_metadata):
-    """Extract patterns and words with search-optimized structure"""
+def compress_body(body, compression=None):
+    """Compress an object body, returning it with its Content-Encoding (None when left as is)"""
+    compression = resolve_compression(compression)
     
-    print("Extracting patterns and words with search-optimized structure...")
+    if compression == 'gzip':
+        # Fixed mtime so identical documents produce identical objects
+        return gzip.compress(body, compresslevel=6, mtime=0), 'gzip'
+    if compression == 'br':
+        return brotli.compress(body, quality=5), 'br'
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(body), 'zstd'
+    return body, None
+
+def iter_json(value, depth=4, batch_size=1000):
+    """Encode a value as compact JSON in pieces, entry by entry for dicts and in batches for lists within depth levels"""
+    if depth and isinstance(value, dict):
+        yield b'{'
+        for index, (key, entry) in enumerate(value.items()):
+            yield (b',' if index else b'') + orjson.dumps(key if isinstance(key, str) else str(key)) + b':'
+            yield from iter_json(entry, depth - 1, batch_size)
+        yield b'}'
+    elif depth and isinstance(value, list):
+        # Long lists such as an item's locations are encoded a slice at a time
+        yield b'['
+        for start in range(0, len(value), batch_size):
+            if start:
+                yield b','
+            yield orjson.dumps(value[start:start + batch_size], option=orjson.OPT_NON_STR_KEYS)[1:-1]
+        yield b']'
+    else:
+        yield orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+
+class StreamCompressor:
+    """Incremental compressor for the output compression encodings, passing data through when uncompressed"""
     
-    # Extract both patterns and words with bounding boxes
-    items = extract_items_with_bounding_boxes(doc)
+    def __init__(self, compression=None):
+        compression = resolve_compression(compression)
+        self.content_encoding = compression
+        
+        if compression == 'gzip':
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            self.compress, self.flush = compressor.compress, compressor.flush
+        elif compression == 'br':
+            compressor = brotli.Compressor(quality=5)
+            self.compress, self.flush = compressor.process, compressor.finish
+        elif compression == 'zstd':
+            compressor = zstandard.ZstdCompressor(level=3).compressobj()
+            self.compress, self.flush = compressor.compress, compressor.flush
+        else:
+            self.content_encoding = None
+            self.compress, self.flush = bytes, bytes
+
+class JsonStreamReader(io.RawIOBase):
+    """Readable stream of a JSON document encoded and compressed as it is read, hashing and counting as it goes"""
     
-    # Calculate confidence scores
-    avg_confidence = calculate_average_confidence(doc)
+    def __init__(self, data, compression=None):
+        # Indented output isn't streamed, it is encoded in one piece
+        self._pieces = iter_json(data) if OUTPUT_JSON_COMPACT else iter([encode_json(data)])
+        self._compressor = StreamCompressor(compression)
+        self._buffer = bytearray()
+        self._finished = False
+        self._sha256 = hashlib.sha256()
+        self.content_encoding = self._compressor.content_encoding
+        self.serialized_bytes = 0
+        self.compressed_bytes = 0
+        self.encode_seconds = 0.0
     
-    # Extract page-level metadata
-    pages_metadata = extract_page_metadata(doc)
+    def readable(self):
+        return True
     
-    # Create search indexes
-    search_indexes = create_search_indexes(items)
+    def readinto(self, buffer):
+        # Fill the whole request unless the document has ended: multipart
+        # uploads take each read as a part, and parts have a minimum size
+        started = time.perf_counter()
+        while len(self._buffer) < len(buffer) and not self._finished:
+            piece = next(self._pieces, None)
+            if piece is None:
+                self._buffer += self._compressor.flush()
+                self._finished = True
+            else:
+                self._sha256.update(piece)
+                self.serialized_bytes += len(piece)
+                self._buffer += self._compressor.compress(piece)
+        self.encode_seconds += time.perf_counter() - started
+        
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        del self._buffer[:size]
+        self.compressed_bytes += size
+        return size
     
-    # Generate statistics
-    statistics = generate_statistics(items)
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+def upload_json_stream(r2_client, bucket_name, key, data):
+    """Upload an output artifact encoded while it uploads, keeping serialization memory flat, and return its stats"""
+    reader = JsonStreamReader(data)
     
-    # Count totals
-    total_items = sum(item["total_count"] for item in items.values())
-    unique_items = len(items)
-    pages_with_content = set()
+    extra_args = {'ContentType': 'application/json'}
+    if reader.content_encoding:
+        extra_args['ContentEncoding'] = reader.content_encoding
     
-    for item in items.values():
-        for location in item["locations"]:
-            pages_with_content.add(location["page"])
+    transfer_config = TransferConfig(
+        multipart_threshold=OUTPUT_MULTIPART_PART_BYTES,
+        multipart_chunksize=OUTPUT_MULTIPART_PART_BYTES,
+        max_concurrency=OUTPUT_MULTIPART_CONCURRENCY
+    )
+    # Read no further ahead than the parts being uploaded, so memory is a few parts whatever the document size
+    transfer_config.max_in_memory_upload_chunks = OUTPUT_MULTIPART_CONCURRENCY
     
-    # Create main search-optimized document
-    main_document = {
-        "document_id": document_id,
-        "source_url": pdf_url,
-        "processed_at": datetime.now().isoformat(),
-        "total_pages": len(doc.pages),
-        "document_metadata": pdf_metadata,
-        "pages_metadata": pages_metadata,
-        "processing_metadata": {
-            "processing_time": str(datetime.now() - start_time),
-            "ocr_confidence": avg_confidence,
-            "total_items": total_items,
-            "unique_items": unique_items,
-            "pages_with_content": sorted(list(pages_with_content))
-        },
-        "items": items,
-        "search_indexes": search_indexes,
-        "statistics": statistics
-    }
+    started = time.perf_counter()
+    r2_client.upload_fileobj(reader, bucket_name, key, ExtraArgs=extra_args, Config=transfer_config)
     
-    # Create simplified summary for quick overview
-    summary = {
-        "document_id": document_id,
-        "total_items": total_items,
-        "unique_items": unique_items,
-        "pages_with_content": len(pages_with_content),
-        "confidence_score": avg_confidence,
-        "document_info": {
-            "filename": pdf_metadata["file_info"]["filename"],
-            "title": pdf_metadata["document_info"].get("title"),
-            "total_pages": pdf_metadata["file_info"]["total_pages"],
-            "file_size_bytes": pdf_metadata["file_info"]["file_size_bytes"]
-        },
-        "item_breakdown": {
-            "patterns": statistics["item_counts_by_type"]["pattern"],
-            "words": statistics["item_counts_by_type"]["word"]
-        },
-        "top_categories": dict(list(statistics["items_by_category"].items())[:5])
+    stats = {
+        "serialized_bytes": reader.serialized_bytes,
+        "sha256": reader.sha256,
+        "compressed_bytes": reader.compressed_bytes,
+        "content_encoding": reader.content_encoding,
+        "encode_seconds": round(reader.encode_seconds, 4),
+        "upload_seconds": round(time.perf_counter() - started, 4),
+        "streamed": True
     }
+    print(f"Streamed {key}: {stats['serialized_bytes']} bytes JSON, "
+          f"{stats['compressed_bytes']} bytes {reader.content_encoding or 'uncompressed'}, "
+          f"encoded in {stats['encode_seconds']}s, uploaded in {stats['upload_seconds']}s")
+    return stats
+
+def serialize_artifact(data):
+    """Encode and compress an output artifact, reporting its sizes and encode time"""
+    started = time.perf_counter()
+    body = encode_json(data)
+    encoded = time.perf_counter()
+    compressed, content_encoding = compress_body(body)
+    finished = time.perf_counter()
     
-    print(f"Extracted {total_items} total items ({unique_items} unique) across {len(pages_with_content)} pages")
-    
-    return {
-        "main_document": main_document,
-        "summary": summary
+    return compressed, content_encoding, {
+        "serialized_bytes": len(body),
+        "sha256": hashlib.sha256(body).hexdigest(),
+        "compressed_bytes": len(compressed),
+        "content_encoding": content_encoding,
+        "encode_seconds": round(encoded - started, 4),
+        "compress_seconds": round(finished - encoded, 4)
     }
 
-def create_search_indexes(items):
-    """Create search indexes for efficient querying"""
-    by_page = {}
-    by_type = {"pattern": [], "word": []}
-    by_category = {}
-    
-    for item_key, item_data in items.items():
-        # Index by type
-        by_type[item_data["type"]].append(item_key)
-        
-        # Index by category
-        category = item_data["category"]
-        if category not in by_category:
-            by_category[category] = []
-        by_category[category].append(item_key)
-        
-        # Index by page
-        for location in item_data["locations"]:
-            page = str(location["page"])
-            if page not in by_page:
-                by_page[page] = []
-            if item_key not in by_page[page]:
-                by_page[page].append(item_key)
+def put_json_artifact(r2_client, bucket_name, key, data, log=True):
+    """Upload an output artifact as compact, compressed JSON and return its serialization stats"""
+    body, content_encoding, stats = serialize_artifact(data)
     
-    return {
-        "by_page": by_page,
-        "by_type": by_type,
-        "by_category": by_category
-    }
+    put_args = {}
+    if content_encoding:
+        put_args['ContentEncoding'] = content_encoding
+    r2_client.put_object(
+        Bucket=bucket_name,
+        Key=key,
+        Body=body,
+        ContentType='application/json',
+        **put_args
+    )
+    
+    if log:
+        print(f"Uploaded {key}: {stats['serialized_bytes']} bytes JSON, "
+              f"{stats['compressed_bytes']} bytes {content_encoding or 'uncompressed'}, "
+              f"encoded in {stats['encode_seconds']}s")
+    return stats
+
+def dictionary_array(values):
+    """Dictionary-encoded string column, indices in order of first appearance"""
+    codes = {}
+    indices = [codes.setdefault(value, len(codes)) for value in values]
+    return pa.DictionaryArray.from_arrays(pa.array(indices, type=pa.int32()), pa.array(list(codes), type=pa.string()))
 
-def generate_statistics(items):
-    """Generate statistics about the extracted items"""
+def nullable_float_array(values):
+    """Float64 column with NaN stored as null"""
+    values = np.asarray(values, dtype=np.float64)
+    return pa.array(values, mask=np.isnan(values))
+
+def build_columnar_tables(main_document):
+    """Items, their locations and page metadata as Arrow tables"""
+    items = main_document["items"]
     
-    # Count by type
-    item_counts_by_type = {"pattern": 0, "word": 0}
+    item_keys = list(items)
+    item_types = [item["type"] for item in items.values()]
+    item_categories = [item["category"] for item in items.values()]
+    items_table = pa.table({
+        "item_key": dictionary_array(item_keys),
+        "type": dictionary_array(item_types),
+        "category": dictionary_array(item_categories),
+        "total_count": pa.array([item["total_count"] for item in items.values()], type=pa.int32())
+    })
     
-    # Count by category
-    items_by_category = {}
+    # One row per location, with item columns repeated through the dictionaries
+    item_indexes = []
+    pages = []
+    bounds = []
+    confidences = []
+    nan_bounds = (math.nan, math.nan, math.nan, math.nan)
+    for item_index, item in enumerate(items.values()):
+        for location in item["locations"]:
+            item_indexes.append(item_index)
+            pages.append(location["page"])
+            confidences.append(location["confidence"])
+            vertices = (location.get("bounding_box") or {}).get("vertices")
+            if vertices:
+                xs = [vertex["x"] for vertex in vertices]
+                ys = [vertex["y"] for vertex in vertices]
+                bounds.append((min(xs), min(ys), max(xs), max(ys)))
+            else:
+                bounds.append(nan_bounds)
     
-    # Pattern type analysis
-    pattern_types = {}
+    # Sorted by page so each row group covers a page range readers can skip by its statistics
+    order = np.argsort(np.asarray(pages, dtype=np.int32), kind='stable')
+    item_indexes = np.asarray(item_indexes, dtype=np.int32)[order]
+    bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)[order]
     
-    # Word frequency
-    word_frequency = {}
+    locations_table = pa.table({
+        "item_key": items_table.column("item_key").take(item_indexes),
+        "type": items_table.column("type").take(item_indexes),
+        "category": items_table.column("category").take(item_indexes),
+        "page": pa.array(np.asarray(pages, dtype=np.int32)[order]),
+        "x0": nullable_float_array(bounds[:, 0]),
+        "y0": nullable_float_array(bounds[:, 1]),
+        "x1": nullable_float_array(bounds[:, 2]),
+        "y1": nullable_float_array(bounds[:, 3]),
+        "confidence": pa.array(np.asarray(confidences, dtype=np.float64)[order])
+    })
     
-    # Page density
-    page_density = {}
+    pages_metadata = main_document.get("pages_metadata", [])
+    pages_table = pa.table({
+        "page_number": pa.array([page["page_number"] for page in pages_metadata], type=pa.int32()),
+        "width": pa.array([page["dimensions"]["width"] for page in pages_metadata], type=pa.float64()),
+        "height": pa.array([page["dimensions"]["height"] for page in pages_metadata], type=pa.float64()),
+        "unit": dictionary_array([page["dimensions"]["unit"] for page in pages_metadata]),
+        **{
+            stat: pa.array([page["content_stats"][stat] for page in pages_metadata], type=pa.int32())
+            for stat in ("tokens", "paragraphs", "lines", "blocks", "tables", "form_fields")
+        }
+    })
     
-    for item_key, item_data in items.items():
-        item_type = item_data["type"]
-        category = item_data["category"]
-        count = item_data["total_count"]
-        
-        # Count by type
-        item_counts_by_type[item_type] += count
-        
-        # Count by category
-        if category not in items_by_category:
-            items_by_category[category] = 0
-        items_by_category[category] += count
-        
-        # Pattern type analysis
-        if item_type == "pattern":
-            prefix = item_key.split('-')[0] if '-' in item_key else item_key[:2]
-            if prefix not in pattern_types:
-                pattern_types[prefix] = 0
-            pattern_types[prefix] += count
-        
-        # Word frequency (top words only)
-        if item_type == "word":
-            word_frequency[item_key] = count
-        
-        # Page density
-        for location in item_data["locations"]:
-            page = location["page"]
-            if page not in page_density:
-                page_density[page] = 0
-            page_density[page] += 1
-    
-    # Sort and limit results
-    items_by_category = dict(sorted(items_by_category.items(), key=lambda x: x[1], reverse=True))
-    pattern_types = dict(sorted(pattern_types.items(), key=lambda x: x[1], reverse=True))
-    word_frequency = dict(sorted(word_frequency.items(), key=lambda x: x[1], reverse=True)[:20])  # Top 20 words
-    pages_by_density = [{"page": page, "item_count": count} for page, count in sorted(page_density.items(), key=lambda x: x[1], reverse=True)]
+    return {"items": items_table, "locations": locations_table, "pages": pages_table}
+
+def encode_columnar_table(table, columnar_format=None):
+    """Encode an Arrow table as Parquet or an Arrow IPC file, returning the bytes and content type"""
+    columnar_format = columnar_format or OUTPUT_COLUMNAR_FORMAT
+    sink = pa.BufferOutputStream()
+    
+    if columnar_format == 'arrow':
+        options = pa.ipc.IpcWriteOptions(compression='zstd')
+        with pa.ipc.new_file(sink, table.schema, options=options) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes(), 'application/vnd.apache.arrow.file'
+    
+    # Both formats compress internally, so the object needs no Content-Encoding
+    pq.write_table(table, sink, compression='zstd', row_group_size=OUTPUT_PARQUET_ROW_GROUP_SIZE)
+    return sink.getvalue().to_pybytes(), 'application/vnd.apache.parquet'
+
+def put_columnar_table(r2_client, bucket_name, key, table):
+    """Upload a columnar table and return its stats"""
+    started = time.perf_counter()
+    body, content_type = encode_columnar_table(table)
+    encode_seconds = time.perf_counter() - started
     
+    r2_client.put_object(Bucket=bucket_name, Key=key, Body=body, ContentType=content_type)
+    
+    print(f"Uploaded {key}: {table.num_rows} rows, {len(body)} bytes")
     return {
-        "item_counts_by_type": item_counts_by_type,
-        "items_by_category": items_by_category,
-        "pattern_types": pattern_types,
-        "word_frequency": word_frequency,
-        "pages_by_density": pages_by_density
+        "rows": table.num_rows,
+        "serialized_bytes": len(body),
+        "encode_seconds": round(encode_seconds, 4)
     }
 
-def extract_items_with_bounding_boxes(doc):
-    """Extract both patterns and words with bounding boxes from Document AI tokens"""
-    items = {}
-    
-    # Define pattern regex - matching PT-1, PT1, M1, M-1, etc.
-    pattern_regex = re.compile(r'\b(PT-?\d+|M-?\d+|[A-Z]-?\d+)\b', re.IGNORECASE)
-    
-    # Define word regex - meaningful words (3+ chars, not purely numeric)
-    word_regex = re.compile(r'\b[A-Za-z][A-Za-z\s]{2,}\b')
-    
-    print("Extracting patterns and words from Document AI tokens...")
-    
-    # Extract from each page's tokens
-    for page_num, page in enumerate(doc.pages, 1):
-        if hasattr(page, 'tokens'):
-            for token in page.tokens:
-                # Get the text content of the token
-                token_text = ""
-                if hasattr(token, 'layout') and hasattr(token.layout, 'text_anchor'):
-                    text_segments = token.layout.text_anchor.text_segments
-                    for segment in text_segments:
-                        start_idx = getattr(segment, 'start_index', 0)
-                        end_idx = getattr(segment, 'end_index', len(doc.text))
-                        token_text += doc.text[start_idx:end_idx]
-                
-                if not token_text.strip():
-                    continue
-                
-                # Extract bounding box and confidence
-                bounding_box = None
-                confidence = 0.95
-                
-                if hasattr(token, 'layout') and hasattr(token.layout, 'bounding_poly'):
-                    vertices = []
-                    if hasattr(token.layout.bounding_poly, 'vertices'):
-                        for vertex in token.layout.bounding_poly.vertices:
-                            vertices.append({
-                                "x": getattr(vertex, 'x', 0),
-                                "y": getattr(vertex, 'y', 0)
-                            })
-                        bounding_box = {
-                            "vertices": vertices
-                        }
-                
-                if hasattr(token, 'layout') and hasattr(token.layout, 'confidence'):
-                    confidence = token.layout.confidence
-                
-                # Check if token is a pattern
-                if pattern_regex.match(token_text):
-                    item_key = token_text.upper().strip()
-                    item_type = "pattern"
-                    category = categorize_pattern(item_key)
-                
-                # Check if token is a meaningful word
-                elif word_regex.match(token_text) and len(token_text.strip()) >= 3:
-                    item_key = token_text.lower().strip()
-                    item_type = "word"
-                    category = categorize_word(item_key)
-                else:
-                    continue
-                
-                # Add to items collection
-                if item_key not in items:
-                    items[item_key] = {
-                        "type": item_type,
-                        "category": category,
-                        "total_count": 0,
-                        "locations": []
-                    }
-                
-                # Check for duplicates on same page
-                existing_on_page = False
-                for existing_loc in items[item_key]["locations"]:
-                    if existing_loc["page"] == page_num:
-                        # If very close coordinates, consider it duplicate
-                        if bounding_box and existing_loc.get("bounding_box"):
-                            existing_on_page = True
-                            break
-                
-                if not existing_on_page:
-                    items[item_key]["locations"].append({
-                        "page": page_num,
-                        "bounding_box": bounding_box,
-                        "confidence": confidence
-                    })
-                    items[item_key]["total_count"] += 1
-        
-        # Also check blocks for additional patterns/words (fallback)
-        if hasattr(page, 'blocks'):
-            for block in page.blocks:
-                if hasattr(block, 'layout') and hasattr(block.layout, 'text_anchor'):
-                    text_segments = block.layout.text_anchor.text_segments
-                    block_text = ""
-                    for segment in text_segments:
-                        start_idx = getattr(segment, 'start_index', 0)
-                        end_idx = getattr(segment, 'end_index', len(doc.text))
-                        block_text += doc.text[start_idx:end_idx]
-                    
-                    # Extract bounding box from block
-                    block_bounding_box = None
-                    block_confidence = 0.85
-                    
-                    if hasattr(block, 'layout') and hasattr(block.layout, 'bounding_poly'):
-                        vertices = []
-                        if hasattr(block.layout.bounding_poly, 'vertices'):
-                            for vertex in block.layout.bounding_poly.vertices:
-                                vertices.append({
-                                    "x": getattr(vertex, 'x', 0),
-                                    "y": getattr(vertex, 'y', 0)
-                                })
-                            block_bounding_box = {
-                                "vertices": vertices
-                            }
-                    
-                    if hasattr(block, 'layout') and hasattr(block.layout, 'confidence'):
-                        block_confidence = block.layout.confidence
-                    
-                    # Find patterns in block text
-                    pattern_matches = pattern_regex.finditer(block_text)
-                    for match in pattern_matches:
-                        item_key = match.group().upper().strip()
-                        
-                        if item_key not in items:
-                            items[item_key] = {
-                                "type": "pattern",
-                                "category": categorize_pattern(item_key),
-                                "total_count": 0,
-                                "locations": []
-                            }
-                        
-                        # Check if we already have this on this page
-                        existing_on_page = any(loc["page"] == page_num for loc in items[item_key]["locations"])
-                        
-                        if not existing_on_page:
-                            items[item_key]["locations"].append({
-                                "page": page_num,
-                                "bounding_box": block_bounding_box,
-                                "confidence": block_confidence
-                            })
-                            items[item_key]["total_count"] += 1
-    
-    print(f"Found {len(items)} unique items")
-    pattern_count = sum(1 for item in items.values() if item["type"] == "pattern")
-    word_count = sum(1 for item in items.values() if item["type"] == "word")
-    print(f"Patterns: {pattern_count}, Words: {word_count}")
-    
-    return items
+def build_page_shards(main_document):
+    """Split a main document into one small document per page with its items, bounding boxes and metadata"""
+    shards = {
+        page_meta["page_number"]: {
+            "document_id": main_document["document_id"],
+            "page": page_meta["page_number"],
+            "page_metadata": page_meta,
+            "items": {}
+        }
+        for page_meta in main_document["pages_metadata"]
+    }
+    
+    for item_key, item in main_document["items"].items():
+        for location in item["locations"]:
+            page_items = shards[location["page"]]["items"]
+            if item_key not in page_items:
+                page_items[item_key] = {
+                    "type": item["type"],
+                    "category": item["category"],
+                    "count": 0,
+                    "locations": []
+                }
+            page_items[item_key]["locations"].append({
+                "bounding_box": location["bounding_box"],
+                "confidence": location["confidence"]
+            })
+            page_items[item_key]["count"] += 1
+    
+    return [shards[page] for page in sorted(shards)]
 
-def categorize_pattern(pattern_text):
-    """Categorize technical patterns"""
-    # Paint patterns: PT-1, PT1, P1, P-1, etc.
-    if (pattern_text.startswith('PT') or 
-        (pattern_text.startswith('P') and len(pattern_text) >= 2 and 
-         (pattern_text[1].isdigit() or pattern_text[1] == '-'))):
-        return "painting"
-    elif pattern_text.startswith('M'):
-        return "mechanical"
-    elif pattern_text.startswith('E'):
-        return "electrical"
-    elif pattern_text.startswith('A'):
-        return "architectural"
-    elif pattern_text.startswith('S'):
-        return "structural"
-    else:
-        return "technical_code"
+def timed_upload(key, upload):
+    """Run one artifact upload, adding its latency and the retries its requests needed to its stats"""
+    started = time.perf_counter()
+    _r2_retries.track(key)
+    try:
+        stats = upload()
+    finally:
+        retries = _r2_retries.pop(key)
+    
+    stats["upload_seconds"] = round(time.perf_counter() - started, 4)
+    stats["retries"] = retries
+    return stats
 
-def categorize_word(word_text):
-    """Categorize words by type"""
-    architectural_elements = {'door', 'window', 'wall', 'roof', 'floor', 'ceiling', 'beam', 'column'}
-    room_types = {'bathroom', 'kitchen', 'bedroom', 'office', 'lobby', 'hallway', 'closet', 'storage'}
-    materials = {'concrete', 'steel', 'wood', 'brick', 'glass', 'aluminum', 'copper'}
-    dimensions = {'length', 'width', 'height', 'depth', 'diameter', 'thickness'}
-    
-    word_lower = word_text.lower()
-    
-    if word_lower in architectural_elements:
-        return "architectural_element"
-    elif word_lower in room_types:
-        return "room_type"
-    elif word_lower in materials:
-        return "material"
-    elif word_lower in dimensions:
-        return "dimension"
-    else:
-        return "general_text"
+def upload_artifacts(uploads):
+    """Upload (name, key, upload) artifacts in parallel over the pooled client, returning stats by name"""
+    with ThreadPoolExecutor(max_workers=OUTPUT_UPLOAD_WORKERS) as executor:
+        futures = [(name, executor.submit(timed_upload, key, upload)) for name, key, upload in uploads]
+        return {name: future.result() for name, future in futures}
+
+def build_manifest(main_document, uploaded_files, shard_entries, content_encoding):
+    """Manifest listing a document's page shards and its other files"""
+    return {
+        "document_id": main_document["document_id"],
+        "total_pages": main_document["total_pages"],
+        "content_encoding": content_encoding,
+        "files": dict(uploaded_files),
+        "shards": shard_entries
+    }
 
 def upload_to_r2(processing_result, r2_config, document_id, app_project_id=None):
-    """Upload all JSON files directly to R2"""
+    """Upload all output artifacts to R2 in parallel, returning their keys and upload stats"""
     print("Uploading results to R2...")
     
-    # Get R2 credentials from Secret Manager
-    client = secretmanager.SecretManagerServiceClient()
-    project_id = "ladders-doc-pipeline-462921"
-    
-    try:
-        access_key = client.access_secret_version(
-            request={"name": f"projects/{project_id}/secrets/r2-access-key/versions/latest"}
-        ).payload.data.decode("UTF-8")
-        
-        secret_key = client.access_secret_version(
-            request={"name": f"projects/{project_id}/secrets/r2-secret-key/versions/latest"}
-        ).payload.data.decode("UTF-8")
-        
-        endpoint = client.access_secret_version(
-            request={"name": f"projects/{project_id}/secrets/r2-endpoint/versions/latest"}
-        ).payload.data.decode("UTF-8")
-    except Exception as e:
-        print(f"Error retrieving R2 credentials: {e}")
-        # Fallback to provided config
-        access_key = r2_config.get('accessKey')
-        secret_key = r2_config.get('secretKey') 
-        endpoint = r2_config.get('endpoint')
-    
-    # Configure R2 client
-    r2_client = boto3.client(
-        's3',
-        endpoint_url=endpoint,
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key,
-        config=Config(signature_version='s3v4'),
-        region_name='auto'
-    )
+    r2_client = get_r2_client(r2_config)
     
     bucket_name = r2_config['bucketName']
-    uploaded_files = {}
+    main_document = processing_result['main_document']
+    started = time.perf_counter()
     
     # Organize files by project if provided
     if app_project_id:
@@ -643,49 +3252,181 @@ def upload_to_r2(processing_result, r2_config, document_id, app_project_id=None)
         base_path = ""
         print("Using default file organization")
     
-    # Upload main document
-    if base_path:
-        main_key = f"{base_path}/documents/{document_id}.json"
-    else:
-        main_key = f"documents/{document_id}.json"
-        
-    r2_client.put_object(
-        Bucket=bucket_name,
-        Key=main_key,
-        Body=json.dumps(processing_result['main_document'], indent=2),
-        ContentType='application/json'
-    )
-    uploaded_files['main_document'] = main_key
-    print(f"Uploaded main document: {main_key}")
-    
-    # Upload summary
+    # Main document and summary, with per-document artifacts in a folder named after the main document
     if base_path:
+        document_prefix = f"{base_path}/documents/{document_id}"
         summary_key = f"{base_path}/summaries/{document_id}.json"
     else:
+        document_prefix = f"documents/{document_id}"
         summary_key = f"summaries/{document_id}.json"
+    
+    # Every artifact as (name, key, upload)
+    uploads = []
+    if OUTPUT_MONOLITHIC:
+        main_key = f"{document_prefix}.json"
+        put_main = upload_json_stream if OUTPUT_STREAMING_UPLOAD else put_json_artifact
+        uploads.append(('main_document', main_key, partial(put_main, r2_client, bucket_name, main_key, main_document)))
+    uploads.append((
+        'summary', summary_key,
+        partial(put_json_artifact, r2_client, bucket_name, summary_key, processing_result['summary'])
+    ))
+    
+    if OUTPUT_COLUMNAR_FORMAT != 'none':
+        extension = 'arrow' if OUTPUT_COLUMNAR_FORMAT == 'arrow' else 'parquet'
+        tables_started = time.perf_counter()
+        for name, table in build_columnar_tables(main_document).items():
+            key = f"{document_prefix}/{name}.{extension}"
+            uploads.append((f"{name}_table", key, partial(put_columnar_table, r2_client, bucket_name, key, table)))
+        print(f"Built columnar tables in {time.perf_counter() - tables_started:.3f}s")
+    
+    shards = build_page_shards(main_document) if OUTPUT_PAGE_SHARDS else []
+    shard_keys = {}
+    for shard in shards:
+        key = f"{document_prefix}/pages/{shard['page']}.json"
+        shard_keys[shard['page']] = key
+        uploads.append((('page', shard['page']), key, partial(put_json_artifact, r2_client, bucket_name, key, shard, log=False)))
+    
+    # Page shards are named by ('page', number) and reported together below
+    results = upload_artifacts(uploads)
+    uploaded_files = {name: key for name, key, _ in uploads if isinstance(name, str)}
+    artifacts = {name: stats for name, stats in results.items() if isinstance(name, str)}
+    
+    # Page shards, then the manifest listing them, which goes last so it never lists a missing object
+    if OUTPUT_PAGE_SHARDS:
+        shard_entries = []
+        for shard in shards:
+            stats = results[('page', shard['page'])]
+            shard_entries.append({
+                "page": shard["page"],
+                "key": shard_keys[shard["page"]],
+                "items": len(shard["items"]),
+                "locations": sum(page_item["count"] for page_item in shard["items"].values()),
+                "serialized_bytes": stats["serialized_bytes"],
+                "compressed_bytes": stats["compressed_bytes"],
+                "sha256": stats["sha256"]
+            })
+        shard_stats = [results[('page', shard['page'])] for shard in shards]
+        artifacts['page_shards'] = {
+            "count": len(shard_entries),
+            "serialized_bytes": sum(entry["serialized_bytes"] for entry in shard_entries),
+            "compressed_bytes": sum(entry["compressed_bytes"] for entry in shard_entries),
+            "encode_seconds": round(sum(stats["encode_seconds"] for stats in shard_stats), 4),
+            "max_upload_seconds": max((stats["upload_seconds"] for stats in shard_stats), default=0),
+            "retries": sum(stats["retries"] for stats in shard_stats)
+        }
+        print(f"Uploaded {len(shard_entries)} page shards under {document_prefix}/pages")
         
-    r2_client.put_object(
-        Bucket=bucket_name,
-        Key=summary_key,
-        Body=json.dumps(processing_result['summary'], indent=2),
-        ContentType='application/json'
-    )
-    uploaded_files['summary'] = summary_key
-    print(f"Uploaded summary: {summary_key}")
+        manifest_key = f"{document_prefix}/manifest.json"
+        manifest = build_manifest(
+            main_document, uploaded_files, shard_entries,
+            shard_stats[0]["content_encoding"] if shard_stats else None
+        )
+        artifacts['manifest'] = timed_upload(
+            manifest_key, partial(put_json_artifact, r2_client, bucket_name, manifest_key, manifest)
+        )
+        uploaded_files['manifest'] = manifest_key
+    
+    retries = sum(stats.get("retries", 0) for stats in artifacts.values())
+    print(f"Uploaded {len(uploads) + bool(OUTPUT_PAGE_SHARDS)} objects in {time.perf_counter() - started:.3f}s with {retries} retries")
+    return uploaded_files, artifacts
+
+
+class PdfDownload:
+    """Spooled download target that hashes, counts and validates PDF bytes as they arrive"""
+    
+    def __init__(self, max_bytes=None):
+        self.max_bytes = MAX_PDF_BYTES if max_bytes is None else max_bytes
+        self.file = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_BYTES, suffix='.pdf')
+        self.size_bytes = 0
+        self._sha256 = hashlib.sha256()
+        self._header = b''
+        self._header_checked = False
+    
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+    
+    def check_content_length(self, content_length):
+        """Reject a download up front when the server reports it is too large"""
+        if content_length and self.max_bytes and int(content_length) > self.max_bytes:
+            raise ValueError(f"PDF is {int(content_length)} bytes, exceeding the {self.max_bytes} byte limit")
+    
+    def write(self, block):
+        """Append a block of the download, enforcing the size limit and PDF header"""
+        if not block:
+            return
+        
+        self.size_bytes += len(block)
+        if self.max_bytes and self.size_bytes > self.max_bytes:
+            raise ValueError(f"PDF exceeds the {self.max_bytes} byte limit")
+        
+        if not self._header_checked:
+            self._header += block[:PDF_HEADER_SEARCH_BYTES - len(self._header)]
+            if len(self._header) >= PDF_HEADER_SEARCH_BYTES:
+                self._check_header()
+        
+        self._sha256.update(block)
+        self.file.write(block)
+    
+    def _check_header(self):
+        # PDF readers accept the %PDF- marker anywhere in the first 1024 bytes
+        if b'%PDF-' not in self._header:
+            raise ValueError(f"Downloaded content is not a PDF (starts with {self._header[:16]!r})")
+        self._header_checked = True
+    
+    def finish(self):
+        """Validate a completed download and rewind it for reading"""
+        if not self._header_checked:
+            self._check_header()
+        
+        self.file.seek(0)
+        print(f"Downloaded PDF: {self.size_bytes} bytes, sha256 {self.sha256}")
+        return self
     
-    return uploaded_files
+    def read_bytes(self):
+        """Return the full downloaded content"""
+        self.file.seek(0)
+        return self.file.read()
+    
+    def close(self):
+        self.file.close()
 
-def download_pdf_to_temp(pdf_url):
-    """Download PDF to temporary file"""
+def download_pdf(pdf_url, max_bytes=None):
+    """Stream PDF into a spooled temporary file, hashing and validating it on the way"""
     print(f"Downloading PDF from: {pdf_url}")
     
-    response = requests.get(pdf_url, timeout=60)
-    response.raise_for_status()
+    pdf_download = PdfDownload(max_bytes)
+    try:
+        with requests.get(pdf_url, timeout=60, stream=True) as response:
+            response.raise_for_status()
+            pdf_download.check_content_length(response.headers.get('Content-Length'))
+            
+            for block in response.iter_content(chunk_size=DOWNLOAD_BLOCK_SIZE):
+                pdf_download.write(block)
+        
+        return pdf_download.finish()
+    except BaseException:
+        pdf_download.close()
+        raise
+
+async def download_pdf_async(pdf_url, max_bytes=None):
+    """Stream PDF into a spooled temporary file without blocking the event loop"""
+    print(f"Downloading PDF from: {pdf_url}")
     
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-        temp_file.write(response.content)
-        print(f"Downloaded PDF to: {temp_file.name}")
-        return temp_file.name
+    pdf_download = PdfDownload(max_bytes)
+    try:
+        session = get_http_session()
+        async with session.get(pdf_url, timeout=aiohttp.ClientTimeout(total=60)) as response:
+            response.raise_for_status()
+            pdf_download.check_content_length(response.headers.get('Content-Length'))
+            
+            async for block in response.content.iter_chunked(DOWNLOAD_BLOCK_SIZE):
+                pdf_download.write(block)
+        
+        return pdf_download.finish()
+    except BaseException:
+        pdf_download.close()
+        raise
 
 def get_context_around_match(text, match_text, match_start, context_length=30):
     """Get context around a pattern match"""
@@ -694,65 +3435,44 @@ def get_context_around_match(text, match_text, match_start, context_length=30):
     
     return text[start:end].strip()
 
-def calculate_average_confidence(doc):
-    """Calculate average confidence score"""
-    confidences = []
-    
-    # Try to extract confidence from entities
-    if hasattr(doc, 'entities'):
-        for entity in doc.entities:
-            if hasattr(entity, 'confidence'):
-                confidences.append(entity.confidence)
-    
-    # If no entities with confidence, try pages
-    if not confidences:
-        for page in doc.pages:
-            for paragraph in page.paragraphs:
-                if hasattr(paragraph, 'confidence'):
-                    confidences.append(paragraph.confidence)
-    
-    return sum(confidences) / len(confidences) if confidences else 0.95
-
-def extract_pdf_metadata(pdf_path, pdf_url):
-    """Extract comprehensive PDF metadata using PyPDF2"""
+def extract_pdf_metadata(pdf_session, pdf_url, pdf_sha256=None):
+    """Extract comprehensive PDF metadata from a parsed PDF session"""
     try:
-        with open(pdf_path, 'rb') as pdf_file:
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            
-            # Get basic document info
-            metadata = {
-                "file_info": {
-                    "filename": os.path.basename(urlparse(pdf_url).path) or "unknown.pdf",
-                    "source_url": pdf_url,
-                    "file_size_bytes": os.path.getsize(pdf_path),
-                    "total_pages": len(pdf_reader.pages)
-                },
-                "document_info": {},
-                "security_info": {
-                    "is_encrypted": pdf_reader.is_encrypted,
-                    "metadata_encrypted": False
-                }
+        # Get basic document info
+        metadata = {
+            "file_info": {
+                "filename": os.path.basename(urlparse(pdf_url).path) or "unknown.pdf",
+                "source_url": pdf_url,
+                "file_size_bytes": pdf_session.file_size,
+                "total_pages": pdf_session.page_count,
+                "sha256": pdf_sha256
+            },
+            "document_info": {},
+            "security_info": {
+                "is_encrypted": pdf_session.is_encrypted,
+                "metadata_encrypted": False
+            }
+        }
+        
+        # Extract document metadata if available
+        doc_info = pdf_session.document_info
+        if doc_info:
+            metadata["document_info"] = {
+                "title": str(doc_info.get('/Title', '')).strip() if doc_info.get('/Title') else None,
+                "author": str(doc_info.get('/Author', '')).strip() if doc_info.get('/Author') else None,
+                "subject": str(doc_info.get('/Subject', '')).strip() if doc_info.get('/Subject') else None,
+                "creator": str(doc_info.get('/Creator', '')).strip() if doc_info.get('/Creator') else None,
+                "producer": str(doc_info.get('/Producer', '')).strip() if doc_info.get('/Producer') else None,
+                "creation_date": str(doc_info.get('/CreationDate', '')).strip() if doc_info.get('/CreationDate') else None,
+                "modification_date": str(doc_info.get('/ModDate', '')).strip() if doc_info.get('/ModDate') else None,
+                "keywords": str(doc_info.get('/Keywords', '')).strip() if doc_info.get('/Keywords') else None
             }
             
-            # Extract document metadata if available
-            if pdf_reader.metadata:
-                doc_info = pdf_reader.metadata
-                metadata["document_info"] = {
-                    "title": str(doc_info.get('/Title', '')).strip() if doc_info.get('/Title') else None,
-                    "author": str(doc_info.get('/Author', '')).strip() if doc_info.get('/Author') else None,
-                    "subject": str(doc_info.get('/Subject', '')).strip() if doc_info.get('/Subject') else None,
-                    "creator": str(doc_info.get('/Creator', '')).strip() if doc_info.get('/Creator') else None,
-                    "producer": str(doc_info.get('/Producer', '')).strip() if doc_info.get('/Producer') else None,
-                    "creation_date": str(doc_info.get('/CreationDate', '')).strip() if doc_info.get('/CreationDate') else None,
-                    "modification_date": str(doc_info.get('/ModDate', '')).strip() if doc_info.get('/ModDate') else None,
-                    "keywords": str(doc_info.get('/Keywords', '')).strip() if doc_info.get('/Keywords') else None
-                }
-                
-                # Clean up empty values
-                metadata["document_info"] = {k: v for k, v in metadata["document_info"].items() if v}
-            
-            return metadata
-            
+            # Clean up empty values
+            metadata["document_info"] = {k: v for k, v in metadata["document_info"].items() if v}
+        
+        return metadata
+        
     except Exception as e:
         print(f"Error extracting PDF metadata: {str(e)}")
         return {
@@ -760,7 +3480,8 @@ def extract_pdf_metadata(pdf_path, pdf_url):
                 "filename": os.path.basename(urlparse(pdf_url).path) or "unknown.pdf",
                 "source_url": pdf_url,
                 "file_size_bytes": 0,
-                "total_pages": 0
+                "total_pages": 0,
+                "sha256": pdf_sha256
             },
             "document_info": {},
             "security_info": {
@@ -770,82 +3491,55 @@ def extract_pdf_metadata(pdf_path, pdf_url):
             "extraction_error": str(e)
         }
 
-def extract_page_metadata(doc):
+def extract_page_metadata(doc, token_table=None):
     """Extract page-level metadata from Document AI results"""
+    if token_table is None:
+        token_table = TokenTable.from_document(doc)
+    
     pages_metadata = []
     
-    for page_num, page in enumerate(doc.pages, 1):
+    # Count content elements on every page at once
+    token_counts = token_table.counts_by_page(ELEMENT_TOKEN).tolist()
+    paragraph_counts = token_table.counts_by_page(ELEMENT_PARAGRAPH).tolist()
+    line_counts = token_table.counts_by_page(ELEMENT_LINE).tolist()
+    block_counts = token_table.counts_by_page(ELEMENT_BLOCK).tolist()
+    
+    for page_index, page in enumerate(token_table.pages):
         page_meta = {
-            "page_number": page_num,
-            "dimensions": {},
+            "page_number": token_table.page_offset + page_index + 1,
+            "dimensions": {
+                "width": page["width"],
+                "height": page["height"],
+                "unit": page["unit"]
+            },
             "layout_info": {},
-            "content_stats": {}
-        }
-        
-        # Extract page dimensions from Document AI
-        if hasattr(page, 'dimension'):
-            page_meta["dimensions"] = {
-                "width": page.dimension.width,
-                "height": page.dimension.height,
-                "unit": page.dimension.unit if hasattr(page.dimension, 'unit') else "pixels"
+            "content_stats": {
+                "tokens": token_counts[page_index],
+                "paragraphs": paragraph_counts[page_index],
+                "lines": line_counts[page_index],
+                "blocks": block_counts[page_index],
+                "tables": page["tables"],
+                "form_fields": page["form_fields"]
             }
-        
-        # Extract layout information
-        if hasattr(page, 'layout'):
-            layout = page.layout
-            if hasattr(layout, 'bounding_poly') and layout.bounding_poly.vertices:
-                vertices = layout.bounding_poly.vertices
-                page_meta["layout_info"]["content_bounds"] = {
-                    "top_left": {"x": vertices[0].x, "y": vertices[0].y},
-                    "top_right": {"x": vertices[1].x, "y": vertices[1].y},
-                    "bottom_right": {"x": vertices[2].x, "y": vertices[2].y},
-                    "bottom_left": {"x": vertices[3].x, "y": vertices[3].y}
-                }
-            
-            if hasattr(layout, 'orientation'):
-                page_meta["layout_info"]["orientation"] = layout.orientation
-        
-        # Count content elements
-        content_stats = {
-            "tokens": 0,
-            "paragraphs": 0,
-            "lines": 0,
-            "blocks": 0,
-            "tables": 0,
-            "form_fields": 0
         }
         
-        # Count tokens
-        if hasattr(page, 'tokens'):
-            content_stats["tokens"] = len(page.tokens)
-        
-        # Count paragraphs
-        if hasattr(page, 'paragraphs'):
-            content_stats["paragraphs"] = len(page.paragraphs)
-        
-        # Count lines
-        if hasattr(page, 'lines'):
-            content_stats["lines"] = len(page.lines)
-        
-        # Count blocks
-        if hasattr(page, 'blocks'):
-            content_stats["blocks"] = len(page.blocks)
-        
-        # Count tables
-        if hasattr(page, 'tables'):
-            content_stats["tables"] = len(page.tables)
-        
-        # Count form fields
-        if hasattr(page, 'form_fields'):
-            content_stats["form_fields"] = len(page.form_fields)
+        # Extract layout information
+        vertices = page["bounds"]
+        if vertices:
+            page_meta["layout_info"]["content_bounds"] = {
+                "top_left": {"x": vertices[0][0], "y": vertices[0][1]},
+                "top_right": {"x": vertices[1][0], "y": vertices[1][1]},
+                "bottom_right": {"x": vertices[2][0], "y": vertices[2][1]},
+                "bottom_left": {"x": vertices[3][0], "y": vertices[3][1]}
+            }
         
-        page_meta["content_stats"] = content_stats
+        page_meta["layout_info"]["orientation"] = page["orientation"]
         
         # Calculate text density (characters per square unit)
-        if hasattr(page, 'dimension') and content_stats["tokens"] > 0:
-            area = page.dimension.width * page.dimension.height
+        if token_counts[page_index] > 0:
+            area = page["width"] * page["height"]
             if area > 0:
-                page_meta["text_density"] = content_stats["tokens"] / area
+                page_meta["text_density"] = token_counts[page_index] / area
         
         pages_metadata.append(page_meta)
     
@@ -862,52 +3556,69 @@ def send_callback(callback_url, result):
         print(f"Callback failed: {e}")
         # Don't fail the whole operation if callback fails
 
+async def send_callback_async(callback_url, result):
+    """Send callback to Cloudflare Worker (legacy) without blocking the event loop"""
+    try:
+        print(f"Sending callback to: {callback_url}")
+        session = get_http_session()
+        async with session.post(callback_url, json=result, timeout=aiohttp.ClientTimeout(total=30)) as response:
+            response.raise_for_status()
+        print("Callback sent successfully")
+    except Exception as e:
+        print(f"Callback failed: {e}")
+        # Don't fail the whole operation if callback fails
+
+def build_webhook_payload(processing_result, r2_config, app_project_id=None):
+    """Build webhook payload with processing results and file URLs"""
+    # Build the base URL for R2 files
+    r2_endpoint = r2_config.get('endpoint', '')
+    bucket_name = r2_config.get('bucketName', '')
+    
+    # Extract the domain from the endpoint (remove protocol and path)
+    if r2_endpoint.startswith('https://'):
+        r2_domain = r2_endpoint.replace('https://', '').split('/')[0]
+    else:
+        r2_domain = r2_endpoint.split('/')[0]
+    
+    # Build public URLs for the uploaded files
+    uploaded_files = processing_result.get('uploaded_files', {})
+    file_urls = {}
+    
+    for file_type, file_path in uploaded_files.items():
+        # Build public URL: https://pub-{account_hash}.r2.dev/{file_path}
+        # We'll use a generic public URL format - adjust based on your R2 setup
+        public_url = f"https://pub-592c678931664039950f4a0846d0d9d1.r2.dev/{file_path}"
+        file_urls[file_type] = public_url
+    
+    # Create webhook payload
+    return {
+        "event": "pdf_processing_complete",
+        "timestamp": datetime.now().isoformat(),
+        "projectID": app_project_id,
+        "projectFileID": processing_result.get('document_id'),
+        "status": processing_result.get('status'),
+        "processing_stats": {
+            "total_pages": processing_result.get('total_pages'),
+            "items_found": processing_result.get('items_found'),
+            "unique_items": processing_result.get('unique_items'),
+            "patterns_found": processing_result.get('patterns_found'),
+            "words_found": processing_result.get('words_found'),
+            "processing_time": processing_result.get('processing_time')
+        },
+        "files": {
+            "document_url": file_urls.get('main_document'),
+            "summary_url": file_urls.get('summary'),
+            "manifest_url": file_urls.get('manifest')
+        },
+        "r2_paths": uploaded_files
+    }
+
 def send_webhook_notification(webhook_url, processing_result, r2_config, app_project_id=None):
     """Send webhook notification with processing results and file URLs"""
     try:
         print(f"Sending webhook notification to: {webhook_url}")
         
-        # Build the base URL for R2 files
-        r2_endpoint = r2_config.get('endpoint', '')
-        bucket_name = r2_config.get('bucketName', '')
-        
-        # Extract the domain from the endpoint (remove protocol and path)
-        if r2_endpoint.startswith('https://'):
-            r2_domain = r2_endpoint.replace('https://', '').split('/')[0]
-        else:
-            r2_domain = r2_endpoint.split('/')[0]
-        
-        # Build public URLs for the uploaded files
-        uploaded_files = processing_result.get('uploaded_files', {})
-        file_urls = {}
-        
-        for file_type, file_path in uploaded_files.items():
-            # Build public URL: https://pub-{account_hash}.r2.dev/{file_path}
-            # We'll use a generic public URL format - adjust based on your R2 setup
-            public_url = f"https://pub-592c678931664039950f4a0846d0d9d1.r2.dev/{file_path}"
-            file_urls[file_type] = public_url
-        
-        # Create webhook payload
-        webhook_payload = {
-            "event": "pdf_processing_complete",
-            "timestamp": datetime.now().isoformat(),
-            "projectID": app_project_id,
-            "projectFileID": processing_result.get('document_id'),
-            "status": processing_result.get('status'),
-            "processing_stats": {
-                "total_pages": processing_result.get('total_pages'),
-                "items_found": processing_result.get('items_found'),
-                "unique_items": processing_result.get('unique_items'),
-                "patterns_found": processing_result.get('patterns_found'),
-                "words_found": processing_result.get('words_found'),
-                "processing_time": processing_result.get('processing_time')
-            },
-            "files": {
-                "document_url": file_urls.get('main_document'),
-                "summary_url": file_urls.get('summary')
-            },
-            "r2_paths": uploaded_files
-        }
+        webhook_payload = build_webhook_payload(processing_result, r2_config, app_project_id)
         
         # Send webhook
         response = requests.post(webhook_url, json=webhook_payload, timeout=30)
@@ -916,4 +3627,27 @@ def send_webhook_notification(webhook_url, processing_result, r2_config, app_pro
         
     except Exception as e:
         print(f"Webhook notification failed: {e}")
-        # Don't fail the whole operation if webhook fails 
\ No newline at end of file
+        # Don't fail the whole operation if webhook fails
+
+async def send_webhook_notification_async(webhook_url, processing_result, r2_config, app_project_id=None):
+    """Send webhook notification without blocking the event loop"""
+    try:
+        print(f"Sending webhook notification to: {webhook_url}")
+        
+        webhook_payload = build_webhook_payload(processing_result, r2_config, app_project_id)
+        
+        # Send webhook
+        session = get_http_session()
+        async with session.post(webhook_url, json=webhook_payload, timeout=aiohttp.ClientTimeout(total=30)) as response:
+            response.raise_for_status()
+        print("Webhook notification sent successfully")
+        
+    except Exception as e:
+        print(f"Webhook notification failed: {e}")
+        # Don't fail the whole operation if webhook fails
+
+# Pay client creation and channel setup at cold start rather than on the first request,
+# but not in extraction pool workers, which only import this module to classify shards.
+# A spawned worker can import it before parent_process() is set, but already has its own name
+if multiprocessing.current_process().name == 'MainProcess':
+    warm_documentai_client()
@@ -0,0 +1,63 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import main
+
+def page_ranges(plan):
+    """(start_page, end_page) of each planned chunk"""
+    return [(chunk["start_page"], chunk["end_page"]) for chunk in plan["chunks"]]
+
+def assert_covers(plan, total_pages):
+    """Chunks are numbered in order and cover every page exactly once"""
+    expected_start = 1
+    for number, chunk in enumerate(plan["chunks"], 1):
+        assert chunk["chunk"] == number
+        assert chunk["start_page"] == expected_start
+        assert chunk["pages"] == chunk["end_page"] - chunk["start_page"] + 1
+        expected_start = chunk["end_page"] + 1
+    assert expected_start == total_pages + 1
+
+def test_small_document_is_one_chunk():
+    plan = main.plan_pdf_chunks([100] * 10, max_pages=15, max_bytes=10_000, target_concurrency=4)
+    assert page_ranges(plan) == [(1, 10)]
+    assert plan["estimated_total_bytes"] == 1000
+
+def test_page_limit_is_respected():
+    plan = main.plan_pdf_chunks([100] * 100, max_pages=15, max_bytes=10**9, target_concurrency=4)
+    assert_covers(plan, 100)
+    assert all(chunk["pages"] <= 15 for chunk in plan["chunks"])
+    # 7 chunks are needed, rounded up to fill the last round of 4 workers
+    assert len(plan["chunks"]) == 8
+
+def test_byte_limit_is_respected():
+    page_sizes = [300, 50, 400, 100, 250, 500, 50, 350, 200, 100]
+    plan = main.plan_pdf_chunks(page_sizes, max_pages=15, max_bytes=800, target_concurrency=1)
+    assert_covers(plan, len(page_sizes))
+    for chunk in plan["chunks"]:
+        assert chunk["estimated_bytes"] == sum(page_sizes[chunk["start_page"] - 1:chunk["end_page"]])
+        assert chunk["estimated_bytes"] <= 800
+
+def test_oversized_page_gets_a_chunk_of_its_own():
+    page_sizes = [7, 9, 8, 300, 2, 2, 2, 2]
+    plan = main.plan_pdf_chunks(page_sizes, max_pages=3, max_bytes=100, target_concurrency=2)
+    assert_covers(plan, len(page_sizes))
+    oversized = [chunk for chunk in plan["chunks"] if chunk["start_page"] <= 4 <= chunk["end_page"]]
+    assert [(chunk["start_page"], chunk["end_page"], chunk["estimated_bytes"]) for chunk in oversized] == [(4, 4, 300)]
+    assert all(chunk["estimated_bytes"] <= 100 for chunk in plan["chunks"] if chunk not in oversized)
+
+def test_signature_is_stable_and_tracks_page_ranges():
+    page_sizes = [100] * 40
+    plan = main.plan_pdf_chunks(page_sizes, max_pages=15, max_bytes=10**9, target_concurrency=4)
+    assert main.plan_pdf_chunks(list(page_sizes), max_pages=15, max_bytes=10**9, target_concurrency=4)["signature"] == plan["signature"]
+
+    # Page sizes that don't move any boundary keep the signature
+    same_ranges = main.plan_pdf_chunks([101] * 40, max_pages=15, max_bytes=10**9, target_concurrency=4)
+    assert page_ranges(same_ranges) == page_ranges(plan)
+    assert same_ranges["signature"] == plan["signature"]
+
+    # Different boundaries must never share checkpoints or cache entries
+    other = main.plan_pdf_chunks(page_sizes, max_pages=5, max_bytes=10**9, target_concurrency=4)
+    assert page_ranges(other) != page_ranges(plan)
+    assert other["signature"] != plan["signature"]
@@ -0,0 +1,95 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from google.cloud import documentai
+
+import main
+
+Page = documentai.Document.Page
+
+def layout(start, end, box=None, normalized_box=None):
+    """Layout anchored to text[start:end], with pixel or normalized (x0, y0, x1, y1) bounds"""
+    if box:
+        x0, y0, x1, y1 = box
+        bounding_poly = documentai.BoundingPoly(vertices=[
+            documentai.Vertex(x=x0, y=y0), documentai.Vertex(x=x1, y=y0),
+            documentai.Vertex(x=x1, y=y1), documentai.Vertex(x=x0, y=y1)
+        ])
+    elif normalized_box:
+        x0, y0, x1, y1 = normalized_box
+        bounding_poly = documentai.BoundingPoly(normalized_vertices=[
+            documentai.NormalizedVertex(x=x0, y=y0), documentai.NormalizedVertex(x=x1, y=y0),
+            documentai.NormalizedVertex(x=x1, y=y1), documentai.NormalizedVertex(x=x0, y=y1)
+        ])
+    else:
+        bounding_poly = documentai.BoundingPoly(vertices=[])
+
+    return Page.Layout(
+        text_anchor=documentai.Document.TextAnchor(text_segments=[
+            documentai.Document.TextAnchor.TextSegment(start_index=start, end_index=end)
+        ]),
+        bounding_poly=bounding_poly,
+        confidence=0.9
+    )
+
+def analyze(text, tokens, blocks=()):
+    """Items found on a single 1000x1000 page"""
+    doc = documentai.Document(text=text, pages=[Page(
+        page_number=1,
+        dimension=Page.Dimension(width=1000, height=1000, unit="pixels"),
+        tokens=[Page.Token(layout=token_layout) for token_layout in tokens],
+        blocks=[Page.Block(layout=block_layout) for block_layout in blocks]
+    )])
+    return main.analyze_document(doc, processes=1)["items"]
+
+def test_repeated_occurrences_are_each_counted():
+    items = analyze("PT-3 PT-3 PT-3", [
+        layout(0, 4, (10, 10, 50, 20)),
+        layout(5, 9, (300, 10, 340, 20)),
+        layout(10, 14, (10, 600, 50, 610))
+    ])
+    assert items["PT-3"]["total_count"] == 3
+
+def test_same_hit_reported_twice_is_counted_once():
+    items = analyze("PT-3", [layout(0, 4, (10, 10, 50, 20)), layout(0, 4, (11, 10, 51, 20))])
+    assert items["PT-3"]["total_count"] == 1
+
+def test_block_adds_only_hits_the_tokens_missed():
+    # The block also covers an M-4 and a third PT-3 that were never tokenized
+    text = "PT-3 door PT-3 M-4 PT-3"
+    items = analyze(text, [
+        layout(0, 4, (10, 10, 50, 20)),
+        layout(5, 9, (60, 10, 100, 20)),
+        layout(10, 14, (110, 10, 150, 20))
+    ], [layout(0, len(text), (5, 5, 300, 25))])
+    assert items["PT-3"]["total_count"] == 3
+    assert items["M-4"]["total_count"] == 1
+    assert items["door"]["total_count"] == 1
+
+def test_missing_vertices_do_not_double_count():
+    text = "M-1 M-1"
+    tokens_with_vertices = [layout(0, 3, (10, 10, 40, 20)), layout(4, 7, (50, 10, 80, 20))]
+    tokens_without_vertices = [layout(0, 3), layout(4, 7)]
+    block_with_vertices = [layout(0, len(text), (5, 5, 100, 25))]
+    block_without_vertices = [layout(0, len(text))]
+
+    for tokens, blocks in (
+        (tokens_without_vertices, block_without_vertices),
+        (tokens_without_vertices, block_with_vertices),
+        (tokens_with_vertices, block_without_vertices)
+    ):
+        assert analyze(text, tokens, blocks)["M-1"]["total_count"] == 2
+
+def test_normalized_vertices_are_used_for_geometry():
+    separate = analyze("M-1 M-1", [
+        layout(0, 3, normalized_box=(0.01, 0.01, 0.04, 0.02)),
+        layout(4, 7, normalized_box=(0.50, 0.50, 0.53, 0.51))
+    ])
+    overlapping = analyze("M-1 M-1", [
+        layout(0, 3, normalized_box=(0.01, 0.01, 0.04, 0.02)),
+        layout(4, 7, normalized_box=(0.011, 0.01, 0.041, 0.02))
+    ])
+    assert separate["M-1"]["total_count"] == 2
+    assert overlapping["M-1"]["total_count"] == 1
@@ -0,0 +1,71 @@
+import gzip
+import hashlib
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import main
+
+def sample_output():
+    """Nested output shaped like the main document, deeper than iter_json's streaming depth"""
+    return {
+        "document_id": "doc-1",
+        "items": {
+            "PT-3": {
+                "type": "pattern",
+                "category": "painting",
+                "total_count": 2500,
+                "locations": [
+                    {"page": page % 7 + 1, "x": page * 0.25, "y": 1 / (page + 1), "text": "PT-3"}
+                    for page in range(2500)
+                ]
+            },
+            "door": {"type": "word", "category": "architectural_element", "total_count": 0, "locations": []}
+        },
+        "pages_metadata": {1: {"tokens": 10, "confidence": 0.91}, 2: {}},
+        "search_indexes": {"by_category": {"painting": ["PT-3"], "unicode": ["Ø 50 — café"]}},
+        "nested": {"a": {"b": {"c": {"d": {"e": [1, [2, [3]], None, True]}}}}},
+        "empty_list": [],
+        "empty_dict": {}
+    }
+
+def read_in_parts(reader, part_size):
+    """Drain a stream the way multipart uploads do, one fixed-size read at a time"""
+    parts = []
+    while True:
+        part = reader.read(part_size)
+        if not part:
+            return b''.join(parts)
+        parts.append(part)
+
+def test_streamed_json_matches_one_piece_encoding():
+    data = sample_output()
+    expected = main.encode_json(data, compact=True)
+    assert b''.join(main.iter_json(data)) == expected
+    # Small batches split the long locations list at many points
+    assert b''.join(main.iter_json(data, batch_size=7)) == expected
+    assert b''.join(main.iter_json(data, depth=1)) == expected
+
+def test_gzip_stream_round_trips(monkeypatch):
+    monkeypatch.setattr(main, 'OUTPUT_JSON_COMPACT', True)
+    data = sample_output()
+    expected = main.encode_json(data, compact=True)
+
+    reader = main.JsonStreamReader(data, 'gzip')
+    body = read_in_parts(reader, 4096)
+
+    assert reader.content_encoding == 'gzip'
+    assert gzip.decompress(body) == expected
+    assert reader.serialized_bytes == len(expected)
+    assert reader.compressed_bytes == len(body)
+    assert reader.sha256 == hashlib.sha256(expected).hexdigest()
+
+def test_uncompressed_stream_passes_json_through(monkeypatch):
+    monkeypatch.setattr(main, 'OUTPUT_JSON_COMPACT', True)
+    data = sample_output()
+
+    reader = main.JsonStreamReader(data, 'none')
+
+    assert reader.content_encoding is None
+    assert read_in_parts(reader, 1000) == main.encode_json(data, compact=True)
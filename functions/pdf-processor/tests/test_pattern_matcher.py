@@ -0,0 +1,87 @@
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import main
+
+# Token classification from before matcher rules existed, which DEFAULT_MATCHER_RULES must reproduce
+BASELINE_PATTERN_REGEX = re.compile(r'\b(PT-?\d+|M-?\d+|[A-Z]-?\d+)\b', re.IGNORECASE)
+BASELINE_WORD_REGEX = re.compile(r'\b[A-Za-z][A-Za-z\s]{2,}\b')
+
+def baseline_categorize_pattern(pattern_text):
+    if (pattern_text.startswith('PT') or
+        (pattern_text.startswith('P') and len(pattern_text) >= 2 and
+         (pattern_text[1].isdigit() or pattern_text[1] == '-'))):
+        return "painting"
+    elif pattern_text.startswith('M'):
+        return "mechanical"
+    elif pattern_text.startswith('E'):
+        return "electrical"
+    elif pattern_text.startswith('A'):
+        return "architectural"
+    elif pattern_text.startswith('S'):
+        return "structural"
+    return "technical_code"
+
+def baseline_categorize_word(word_text):
+    categories = {
+        "architectural_element": {'door', 'window', 'wall', 'roof', 'floor', 'ceiling', 'beam', 'column'},
+        "room_type": {'bathroom', 'kitchen', 'bedroom', 'office', 'lobby', 'hallway', 'closet', 'storage'},
+        "material": {'concrete', 'steel', 'wood', 'brick', 'glass', 'aluminum', 'copper'},
+        "dimension": {'length', 'width', 'height', 'depth', 'diameter', 'thickness'}
+    }
+    word_lower = word_text.lower()
+    for category, words in categories.items():
+        if word_lower in words:
+            return category
+    return "general_text"
+
+def baseline_classify(token_text):
+    if BASELINE_PATTERN_REGEX.match(token_text):
+        item_key = token_text.upper().strip()
+        return item_key, "pattern", baseline_categorize_pattern(item_key)
+    if BASELINE_WORD_REGEX.match(token_text) and len(token_text.strip()) >= 3:
+        item_key = token_text.lower().strip()
+        return item_key, "word", baseline_categorize_word(item_key)
+    return None
+
+TOKENS = [
+    "PT-1", "PT1", "pt-12", "Pt3", "P-2", "P3", "p-", "PT", "PT-", "PT-1a",
+    "M-12", "m4", "M", "E1", "e-22", "A-101", "S2", "s-9", "X9", "Z-0", "Q-7", "K1", "PT-1 ", "M-4\n",
+    "door", "Door", "DOOR ", "window", "Ceiling", "bathroom", "Lobby", "concrete", "Steel", "ALUMINUM",
+    "height", "Thickness", "hello world", "ab", "abc", "ID", "x", "-", "12", "123abc", "-5", "1st",
+    "a1b", "door-frame", " door", "\tPT-1", "café", "é1", "Ø50", "GWB", "ACT-1", "N/A", "3/4\"", "#5",
+    "__init__", "", "   "
+]
+
+def test_default_rules_classify_tokens_like_the_baseline():
+    matcher = main.PatternMatcher(main.DEFAULT_MATCHER_RULES)
+    for token_text in TOKENS:
+        if not token_text.strip():
+            continue
+        assert matcher.classify_token(token_text) == baseline_classify(token_text), token_text
+
+def test_prefilters_keep_every_token_the_baseline_matches():
+    matcher = main.PatternMatcher(main.DEFAULT_MATCHER_RULES)
+    matched = [token_text for token_text in TOKENS if token_text.strip() and baseline_classify(token_text)]
+    allowed = matcher.allows_first_codepoints([ord(token_text[0]) for token_text in matched])
+    assert allowed.all()
+    assert all(len(token_text) >= matcher.min_token_length for token_text in matched)
+
+def test_default_rules_find_baseline_patterns_in_block_text():
+    matcher = main.PatternMatcher(main.DEFAULT_MATCHER_RULES)
+    block_text = "See PT-1 and m4 on A-101, not PT-1a or 12; E1/S2 (x9)"
+    expected = [
+        (match.group().upper().strip(), "pattern", baseline_categorize_pattern(match.group().upper().strip()))
+        for match in BASELINE_PATTERN_REGEX.finditer(block_text)
+    ]
+    assert list(matcher.scan_block(block_text)) == expected
+
+def test_prefilter_follows_rules_starting_with_a_digit():
+    rules = dict(main.DEFAULT_MATCHER_RULES)
+    rules["patterns"] = rules["patterns"] + [{"regex": r"\b\d{2}-\d{3}\b", "default_category": "keynote"}]
+    matcher = main.PatternMatcher(rules)
+    assert matcher.allows_first_codepoints([ord("0"), ord("-")]).tolist() == [True, False]
+    assert matcher.classify_token("09-210") == ("09-210", "pattern", "keynote")
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+# Benchmark item extraction on a synthetic Document AI response
+#
+# Usage: python scripts/benchmark-extraction.py [--pages 500] [--tokens-per-page 400] [--processes 4] [--response doc.json]
+#
+# --response replays a recorded Document AI response (Document JSON) for the
+# proto-plus vs raw protobuf comparison instead of the synthetic document.
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions', 'pdf-processor'))
+
+from google.cloud import documentai
+
+import main
+
+# Drawing vocabulary: repeated words and codes give items thousands of locations
+VOCABULARY = [
+    "steel", "door", "window", "concrete", "wall", "ceiling", "kitchen", "office",
+    "PT-1", "PT-2", "M-4", "E12", "A-101", "S-3", "width", "height", "to", "by", "12"
+]
+
+def build_synthetic_document(pages, tokens_per_page):
+    """Build a Document AI response with one token per word and one block per line of tokens"""
+    text_parts = []
+    offset = 0
+    doc_pages = []
+
+    for page_index in range(pages):
+        tokens = []
+        blocks = []
+        block_start = offset
+
+        for token_index in range(tokens_per_page):
+            word = VOCABULARY[(page_index * 7 + token_index) % len(VOCABULARY)]
+            x = 40 + (token_index % 20) * 60
+            y = 40 + (token_index // 20) * 30
+
+            tokens.append(documentai.Document.Page.Token(layout=documentai.Document.Page.Layout(
+                text_anchor=documentai.Document.TextAnchor(text_segments=[
+                    documentai.Document.TextAnchor.TextSegment(start_index=offset, end_index=offset + len(word))
+                ]),
+                bounding_poly=documentai.BoundingPoly(vertices=[
+                    documentai.Vertex(x=x, y=y), documentai.Vertex(x=x + 50, y=y),
+                    documentai.Vertex(x=x + 50, y=y + 20), documentai.Vertex(x=x, y=y + 20)
+                ]),
+                confidence=0.98
+            )))
+            text_parts.append(word + " ")
+            offset += len(word) + 1
+
+            # Close a block every 20 tokens
+            if token_index % 20 == 19:
+                blocks.append(documentai.Document.Page.Block(layout=documentai.Document.Page.Layout(
+                    text_anchor=documentai.Document.TextAnchor(text_segments=[
+                        documentai.Document.TextAnchor.TextSegment(start_index=block_start, end_index=offset)
+                    ]),
+                    bounding_poly=documentai.BoundingPoly(vertices=[
+                        documentai.Vertex(x=40, y=y), documentai.Vertex(x=1240, y=y),
+                        documentai.Vertex(x=1240, y=y + 20), documentai.Vertex(x=40, y=y + 20)
+                    ]),
+                    confidence=0.9
+                )))
+                block_start = offset
+
+        doc_pages.append(documentai.Document.Page(
+            page_number=page_index + 1,
+            dimension=documentai.Document.Page.Dimension(width=1300, height=1000, unit="pixels"),
+            tokens=tokens,
+            blocks=blocks
+        ))
+
+    return documentai.Document(text="".join(text_parts), pages=doc_pages)
+
+def time_call(func, *args, repeat=3):
+    """Return the best wall time of several runs and the last result"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def compare_table_sources(doc, repeat):
+    """Time TokenTable construction through proto-plus wrappers, raw protobuf and serialized bytes"""
+    serialized = documentai.Document.serialize(doc)
+
+    modes = [
+        ("proto-plus", lambda: main.TokenTable.from_document(doc, source='proto-plus')),
+        ("protobuf", lambda: main.TokenTable.from_document(doc, source='protobuf')),
+        ("serialized bytes", lambda: main.TokenTable.from_serialized(serialized))
+    ]
+
+    baseline_elapsed = None
+    baseline_rows = None
+    for name, build in modes:
+        elapsed, token_table = time_call(build, repeat=repeat)
+        baseline_elapsed = baseline_elapsed or elapsed
+        if baseline_rows is None:
+            baseline_rows = token_table.rows
+        identical = token_table.rows.tobytes() == baseline_rows.tobytes()
+        print(f"TokenTable source {name:<17} {elapsed:8.3f}s  {baseline_elapsed / elapsed:5.2f}x  identical={identical}")
+
+# Separate-pass reference versions of the analyzer's indexes, statistics and confidence
+def create_search_indexes(items):
+    """Create search indexes for efficient querying"""
+    by_page = {}
+    by_type = {"pattern": [], "word": []}
+    by_category = {}
+
+    for item_key, item_data in items.items():
+        # Index by type
+        by_type[item_data["type"]].append(item_key)
+
+        # Index by category
+        category = item_data["category"]
+        if category not in by_category:
+            by_category[category] = []
+        by_category[category].append(item_key)
+
+        # Index by page
+        for location in item_data["locations"]:
+            page = str(location["page"])
+            if page not in by_page:
+                by_page[page] = []
+            if item_key not in by_page[page]:
+                by_page[page].append(item_key)
+
+    return {
+        "by_page": by_page,
+        "by_type": by_type,
+        "by_category": by_category
+    }
+
+def generate_statistics(items):
+    """Generate statistics about the extracted items"""
+
+    # Count by type
+    item_counts_by_type = {"pattern": 0, "word": 0}
+
+    # Count by category
+    items_by_category = {}
+
+    # Pattern type analysis
+    pattern_types = {}
+
+    # Word frequency
+    word_frequency = {}
+
+    # Page density
+    page_density = {}
+
+    for item_key, item_data in items.items():
+        item_type = item_data["type"]
+        category = item_data["category"]
+        count = item_data["total_count"]
+
+        # Count by type
+        item_counts_by_type[item_type] += count
+
+        # Count by category
+        if category not in items_by_category:
+            items_by_category[category] = 0
+        items_by_category[category] += count
+
+        # Pattern type analysis
+        if item_type == "pattern":
+            prefix = item_key.split('-')[0] if '-' in item_key else item_key[:2]
+            if prefix not in pattern_types:
+                pattern_types[prefix] = 0
+            pattern_types[prefix] += count
+
+        # Word frequency (top words only)
+        if item_type == "word":
+            word_frequency[item_key] = count
+
+        # Page density
+        for location in item_data["locations"]:
+            page = location["page"]
+            if page not in page_density:
+                page_density[page] = 0
+            page_density[page] += 1
+
+    # Sort and limit results
+    items_by_category = dict(sorted(items_by_category.items(), key=lambda x: x[1], reverse=True))
+    pattern_types = dict(sorted(pattern_types.items(), key=lambda x: x[1], reverse=True))
+    word_frequency = dict(sorted(word_frequency.items(), key=lambda x: x[1], reverse=True)[:20])  # Top 20 words
+    pages_by_density = [{"page": page, "item_count": count} for page, count in sorted(page_density.items(), key=lambda x: x[1], reverse=True)]
+
+    return {
+        "item_counts_by_type": item_counts_by_type,
+        "items_by_category": items_by_category,
+        "pattern_types": pattern_types,
+        "word_frequency": word_frequency,
+        "pages_by_density": pages_by_density
+    }
+
+def calculate_average_confidence(doc, token_table=None):
+    """Calculate average confidence score"""
+    confidences = []
+
+    # Try to extract confidence from entities
+    if hasattr(doc, 'entities'):
+        for entity in doc.entities:
+            if hasattr(entity, 'confidence'):
+                confidences.append(entity.confidence)
+
+    if confidences:
+        return sum(confidences) / len(confidences)
+
+    # If no entities with confidence, average the paragraph layouts
+    if token_table is None:
+        token_table = main.TokenTable.from_document(doc)
+
+    paragraph_confidences = token_table.rows["confidence"][token_table.rows["kind"] == main.ELEMENT_PARAGRAPH]
+    return float(paragraph_confidences.mean()) if len(paragraph_confidences) else 0.95
+
+def separate_passes(doc):
+    """Analysis as separate passes over the document and the extracted items"""
+    token_table = main.TokenTable.from_document(doc)
+    items = main.extract_items_with_bounding_boxes(doc, token_table)
+    pages_with_content = set()
+    for item in items.values():
+        for location in item["locations"]:
+            pages_with_content.add(location["page"])
+
+    return {
+        "items": items,
+        "search_indexes": create_search_indexes(items),
+        "statistics": generate_statistics(items),
+        "avg_confidence": calculate_average_confidence(doc, token_table),
+        "pages_metadata": main.extract_page_metadata(doc, token_table),
+        "page_count": len(doc.pages),
+        "total_items": sum(item["total_count"] for item in items.values()),
+        "pages_with_content": sorted(pages_with_content)
+    }
+
+def compare_analysis_passes(doc, repeat):
+    """Time the fused analyzer against separate passes and check the results match"""
+    separate_elapsed, separate = time_call(separate_passes, doc, repeat=repeat)
+    fused_elapsed, fused = time_call(main.analyze_document, doc, repeat=repeat)
+    identical = json.dumps(separate) == json.dumps(fused)
+    print(f"Separate passes  {separate_elapsed:8.3f}s")
+    print(f"Fused analyzer   {fused_elapsed:8.3f}s  {separate_elapsed - fused_elapsed:+.3f}s saved  identical={identical}")
+
+def compare_extraction_processes(doc, repeat, processes):
+    """Time in-process extraction against the page-parallel process pool and check the results match"""
+    token_table = main.TokenTable.from_document(doc)
+    serial_elapsed, serial = time_call(main.analyze_document, doc, token_table, None, 1, repeat=repeat)
+    # The first parallel run pays for starting the pool
+    main.analyze_document(doc, token_table, None, processes)
+    parallel_elapsed, parallel = time_call(main.analyze_document, doc, token_table, None, processes, repeat=repeat)
+    identical = json.dumps(serial) == json.dumps(parallel)
+    print(f"In-process extraction  {serial_elapsed:8.3f}s")
+    print(f"{processes} extraction processes {parallel_elapsed:8.3f}s  {serial_elapsed / parallel_elapsed:5.2f}x  identical={identical}")
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Benchmark item extraction on a synthetic document")
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--tokens-per-page', type=int, default=400)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--processes', type=int, default=main.EXTRACTION_PROCESSES)
+    parser.add_argument('--response', help="Recorded Document AI response (Document JSON) for the source comparison")
+    args = parser.parse_args()
+
+    print(f"Building synthetic document: {args.pages} pages x {args.tokens_per_page} tokens")
+
+    # Time per page stays flat as the page count grows when duplicate checks are O(1)
+    page_counts = sorted({max(1, args.pages // 10), max(1, args.pages // 4), max(1, args.pages // 2), args.pages})
+    for pages in page_counts:
+        doc = build_synthetic_document(pages, args.tokens_per_page)
+        build_elapsed, token_table = time_call(main.TokenTable.from_document, doc, repeat=args.repeat)
+        elapsed, items = time_call(main.extract_items_with_bounding_boxes, doc, token_table, repeat=args.repeat)
+        locations = sum(len(item["locations"]) for item in items.values())
+        print(f"TokenTable.from_document:          {pages:>5} pages  {build_elapsed:8.3f}s  "
+              f"{build_elapsed / pages * 1000:7.2f} ms/page  {len(token_table.rows)} rows")
+        print(f"extract_items_with_bounding_boxes: {pages:>5} pages  {elapsed:8.3f}s  "
+              f"{elapsed / pages * 1000:7.2f} ms/page  {len(items)} items  {locations} locations")
+
+    if args.response:
+        with open(args.response) as response_file:
+            doc = documentai.Document.from_json(response_file.read(), ignore_unknown_fields=True)
+        print(f"Comparing TokenTable sources on {args.response} ({len(doc.pages)} pages)")
+    else:
+        print(f"Comparing TokenTable sources on the {args.pages}-page synthetic document")
+    compare_table_sources(doc, args.repeat)
+    compare_analysis_passes(doc, args.repeat)
+    if args.processes > 1:
+        compare_extraction_processes(doc, args.repeat, args.processes)
+
+if __name__ == '__main__':
+    main_benchmark()